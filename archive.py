@@ -0,0 +1,277 @@
+# archive.py
+# type: ignore
+
+# binary drawing format, little endian, every section 8-byte aligned:
+#   header       magic, version, board color, history index and section sizes
+#   layers       UTF-8 JSON list of layer states, bottom to top
+#   stroke table shape, cap, size, rgba, layer, bounds, point offset and count
+#   base         stroke ids on the board before the oldest kept step
+#   op table     step, op, kind, index, stroke id; one row per stroke of an op,
+#                a split is the cut stroke's row followed by its pieces
+#   points       one int32 (x, y) buffer for all strokes
+# strokes are read as views into the memory-mapped file, their points are
+# only paged in when they are painted or hit-tested. Version 1 files have
+# no layers section and no stroke layer, everything is on layer 0. Version 3
+# adds the poly shape and split ops to the version 2 layout
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from history import AddStroke, RemoveStrokes, ClearStrokes, SplitStroke
+from session import replacing
+from stroke import Stroke
+
+MAGIC = b"SPEN"
+VERSION = 3
+
+PREFIX = struct.Struct("<4sH")
+HEADERS = {
+    1: struct.Struct("<4sHH4BIIIIIQ"),
+    2: struct.Struct("<4sHH4BIIIIIQII"),
+}
+HEADERS[3] = HEADERS[2]
+SHAPES = ("free", "line", "rect", "poly")
+KINDS = (AddStroke, RemoveStrokes, ClearStrokes, SplitStroke)
+
+STROKE_DTYPES = {
+    1: np.dtype(
+        [
+            ("shape", "<u1"),
+            ("round_cap", "<u1"),
+            ("size", "<u2"),
+            ("rgba", "<u4"),
+            ("bounds", "<i4", 4),
+            ("offset", "<u8"),
+            ("count", "<u8"),
+        ]
+    ),
+    2: np.dtype(
+        [
+            ("shape", "<u1"),
+            ("round_cap", "<u1"),
+            ("size", "<u2"),
+            ("rgba", "<u4"),
+            ("layer", "<u4"),
+            ("pad", "<u4"),
+            ("bounds", "<i4", 4),
+            ("offset", "<u8"),
+            ("count", "<u8"),
+        ]
+    ),
+}
+STROKE_DTYPES[3] = STROKE_DTYPES[2]
+OP_DTYPE = np.dtype(
+    [
+        ("step", "<u4"),
+        ("op", "<u4"),
+        ("kind", "<u1"),
+        ("pad", "<u1", 3),
+        ("index", "<u4"),
+        ("stroke", "<u4"),
+    ]
+)
+
+
+class MappedFile(mmap.mmap):
+    # a read-only archive mapping that knows its file
+    path = None
+
+
+def mapped_path(xy):
+    # the archive file points are mapped from, None for points in memory
+    base = xy
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    return base.path if isinstance(base, MappedFile) else None
+
+
+def unmap_points(strokes, path):
+    # Windows cannot replace a file that is still mapped: strokes read from
+    # path get their points copied into memory, the same values, and the
+    # mapping closes with its last view
+    path = os.path.realpath(path)
+    for s in strokes:
+        if mapped_path(s.xy) == path:
+            xy = s.xy.copy()
+            xy.flags.writeable = False
+            s.xy = xy
+
+
+def is_archive(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def aligned(n):
+    return (n + 7) & ~7
+
+
+def op_rows(op):
+    if isinstance(op, AddStroke):
+        return [(0, op.stroke)]
+    elif isinstance(op, RemoveStrokes):
+        return list(op.removed)
+    elif isinstance(op, ClearStrokes):
+        return [(0, s) for s in op.strokes]
+    elif isinstance(op, SplitStroke):
+        return [(op.index, op.stroke)] + [(0, s) for s in op.pieces]
+    raise ValueError(f"Unknown history op: {op!r}")
+
+
+def write_archive(path, board_color, history, current, layers=(), progress=None):
+    ids = {}
+    strokes = []
+
+    def ref(s):
+        if id(s) not in ids:
+            ids[id(s)] = len(strokes)
+            strokes.append(s)
+        return ids[id(s)]
+
+    base = np.array([ref(s) for s in history.base(current)], dtype="<u4")
+
+    ops = []
+    n_ops = 0
+    for i, step in enumerate(history.steps):
+        for op in step:
+            kind = KINDS.index(type(op))
+            for index, s in op_rows(op):
+                ops.append((i, n_ops, kind, (0, 0, 0), index, ref(s)))
+            n_ops += 1
+    ops = np.array(ops, dtype=OP_DTYPE)
+
+    rows = []
+    offset = 0
+    for s in strokes:
+        shape = SHAPES.index(s.shape)
+        rows.append(
+            (
+                shape,
+                s.round_cap,
+                s.size,
+                s.rgba,
+                s.layer,
+                0,
+                s.bounds,
+                offset,
+                len(s.xy),
+            )
+        )
+        offset += len(s.xy)
+    table = np.array(rows, dtype=STROKE_DTYPES[VERSION])
+    layer_table = json.dumps(list(layers), ensure_ascii=False).encode("utf-8")
+
+    header = HEADERS[VERSION].pack(
+        MAGIC,
+        VERSION,
+        0,
+        *board_color,
+        history.index,
+        len(strokes),
+        len(base),
+        len(history.steps),
+        len(ops),
+        offset,
+        len(layer_table),
+        0,
+    )
+
+    # the old file may still be mapped, never truncate it in place
+    unmap_points(strokes, path)
+    with replacing(path, "wb") as f:
+        chunks = (header, layer_table, table.tobytes(), base.tobytes(), ops.tobytes())
+        for chunk in chunks:
+            f.write(chunk)
+            f.write(b"\0" * (aligned(len(chunk)) - len(chunk)))
+
+        for i, s in enumerate(strokes):
+            f.write(s.xy.astype("<i4", copy=False).tobytes())
+
+            if progress and i % 256 == 0:
+                progress(i, len(strokes))
+
+
+def read_archive(path, progress=None):
+    with open(path, "rb") as f:
+        buf = MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf.path = os.path.realpath(path)
+
+    magic, version = PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC or version not in HEADERS:
+        raise ValueError(f"Unsupported drawing archive: {path}")
+
+    layout = HEADERS[version]
+    fields = layout.unpack_from(buf, 0)
+    board_color = list(fields[3:7])
+    history_index, n_strokes, n_base, n_steps, n_ops, n_points = fields[7:13]
+
+    def section(offset, dtype, count):
+        array = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        return array, offset + aligned(array.nbytes)
+
+    offset = aligned(layout.size)
+    layers = []
+    if version >= 2:
+        n_layer_bytes = fields[13]
+        layers = json.loads(buf[offset : offset + n_layer_bytes])
+        offset += aligned(n_layer_bytes)
+
+    table, offset = section(offset, STROKE_DTYPES[version], n_strokes)
+    base, offset = section(offset, "<u4", n_base)
+    ops, offset = section(offset, OP_DTYPE, n_ops)
+    points, _ = section(offset, "<i4", n_points * 2)
+    points = points.reshape(-1, 2)
+
+    if version >= 2:
+        rows = table.tolist()
+    else:
+        rows = [(a, b, c, d, 0, 0, *rest) for a, b, c, d, *rest in table.tolist()]
+
+    pool = []
+    for shape, round_cap, size, rgba, layer, _, bounds, start, count in rows:
+        pool.append(
+            Stroke(
+                SHAPES[shape],
+                int(rgba),
+                int(size),
+                bool(round_cap),
+                points[start : start + count],
+                tuple(int(v) for v in bounds),
+                int(layer),
+            )
+        )
+
+        if progress and len(pool) % 256 == 0:
+            progress(len(pool), n_strokes)
+
+    steps = [[] for _ in range(n_steps)]
+    records = ops.tolist()
+    rows = []
+    for i, (step, op, kind, _, index, sid) in enumerate(records):
+        rows.append((index, pool[sid]))
+        if i + 1 < n_ops and records[i + 1][1] == op:
+            continue
+
+        if KINDS[kind] is AddStroke:
+            steps[step].append(AddStroke(rows[0][1]))
+        elif KINDS[kind] is RemoveStrokes:
+            steps[step].append(RemoveStrokes(tuple(rows)))
+        elif KINDS[kind] is SplitStroke:
+            pieces = tuple(s for _, s in rows[1:])
+            steps[step].append(SplitStroke(rows[0][0], rows[0][1], pieces))
+        else:
+            steps[step].append(ClearStrokes(tuple(s for _, s in rows)))
+        rows = []
+
+    header = {
+        "board_color": board_color,
+        "history_index": history_index,
+        "layers": layers,
+    }
+    return header, [pool[sid] for sid in base.tolist()], steps
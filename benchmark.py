@@ -0,0 +1,1359 @@
+# benchmark.py
+# type: ignore
+
+from contextlib import contextmanager
+from itertools import groupby
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide2.QtWidgets import QApplication
+from PySide2.QtGui import QColor, QImage, QMouseEvent, QPainter, QPainterPath, QPen
+from PySide2.QtCore import Qt, QEvent, QPoint, QPointF, QRect
+
+from geometry import simplify_polyline
+from archive import write_archive, read_archive
+from daemon import send_command
+from history import AddStroke, RemoveStrokes, SplitStroke, step_nbytes
+from journal import Journal, read_journal
+from session import save_session, load_session
+from stroke import Stroke, free_curve_path
+import numpy as np
+
+BOARD_WIDTH = 3840
+BOARD_HEIGHT = 2160
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+WHITE = 0xFFFFFFFF
+
+
+# synthetic input
+def random_walk(rng, points=8, step=8):
+    x = rng.randrange(BOARD_WIDTH)
+    y = rng.randrange(BOARD_HEIGHT)
+
+    xy = []
+    for _ in range(points):
+        xy.append((x, y))
+        x += rng.randint(-step, step)
+        y += rng.randint(-step, step)
+
+    return xy
+
+
+def random_free_stroke(rng, points=8, step=8, size=4):
+    return Stroke("free", WHITE, size, True, random_walk(rng, points, step))
+
+
+def recorded_stroke(rng, size=4):
+    # a pen trajectory sampled the way Canva.move_stroke_to keeps points
+    x = rng.uniform(200, BOARD_WIDTH - 200)
+    y = rng.uniform(200, BOARD_HEIGHT - 200)
+    heading = rng.uniform(0, 2 * math.pi)
+    speed = rng.choice((0.5, 2, 8))
+    bend = rng.choice((0, 0.01, 0.05, 0.2))
+
+    pts = [QPoint(round(x), round(y))]
+    for i in range(rng.randint(100, 2000)):
+        heading += bend * math.sin(i / 15) + rng.gauss(0, 0.02)
+        x += speed * math.cos(heading)
+        y += speed * math.sin(heading)
+
+        pos = QPoint(round(x), round(y))
+        if (pos - pts[-1]).manhattanLength() >= size / 4:
+            pts.append(pos)
+
+    return pts
+
+
+def polyline_distance2(xy, x, y):
+    if len(xy) == 1:
+        dx = float(xy[0, 0]) - x
+        dy = float(xy[0, 1]) - y
+        return dx * dx + dy * dy
+
+    f = xy.astype(np.float64)
+    ax = f[:-1, 0]
+    ay = f[:-1, 1]
+    abx = f[1:, 0] - ax
+    aby = f[1:, 1] - ay
+    apx = x - ax
+    apy = y - ay
+
+    len2 = abx * abx + aby * aby
+    len2[len2 == 0] = 1
+    t = (apx * abx + apy * aby) / len2
+    np.clip(t, 0, 1, out=t)
+
+    dx = apx - t * abx
+    dy = apy - t * aby
+    return float((dx * dx + dy * dy).min())
+
+
+def polyline_hit(xy, x, y, r):
+    return polyline_distance2(xy, x, y) < r * r
+
+
+def curve_deviation(a, b):
+    # symmetric max distance between the two rendered curves
+    def flatten(xy):
+        path = free_curve_path([QPoint(x, y) for x, y in xy.tolist()])
+        return np.array(
+            [(p.x(), p.y()) for poly in path.toSubpathPolygons() for p in poly]
+        )
+
+    fa = flatten(a)
+    fb = flatten(b)
+    d2 = max(
+        max(polyline_distance2(fb, x, y) for x, y in fa),
+        max(polyline_distance2(fa, x, y) for x, y in fb),
+    )
+    return math.sqrt(d2)
+
+
+def random_positions(rng, count):
+    return [
+        QPoint(rng.randrange(BOARD_WIDTH), rng.randrange(BOARD_HEIGHT))
+        for _ in range(count)
+    ]
+
+
+def make_window():
+    from window import Window
+
+    app = QApplication.instance() or QApplication([])
+    window = Window()
+    app.processEvents()
+    return window
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def allocated_bytes(build):
+    gc.collect()
+    if rss_bytes() is None:
+        tracemalloc.start()
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        before = rss_bytes()
+        result = build()
+        size = rss_bytes() - before
+
+    return result, size
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+# benchmarks
+# the whole-stroke hit test the eraser used before it split strokes
+def stroke_hit(s, pos, r):
+    p = pos.x(), pos.y()
+
+    if s.shape in ("free", "poly"):
+        return polyline_hit(s.xy, p[0], p[1], r)
+    elif s.shape == "line":
+        a, b = s.xy.tolist()
+        return line_hit(a, b, p, r)
+    elif s.shape == "rect":
+        return rect_hit(s.bounds, p, r)
+    else:
+        return False
+
+
+def line_hit(a, b, p, r):
+    ax, ay = a
+    bx, by = b
+    px, py = p
+
+    abx, aby = bx - ax, by - ay
+    apx, apy = px - ax, py - ay
+    ab_len2 = abx * abx + aby * aby
+
+    if ab_len2 == 0:
+        return math.hypot(px - ax, py - ay) <= r
+
+    t = max(0, min(1, (apx * abx + apy * aby) / ab_len2))
+    cx = ax + t * abx
+    cy = ay + t * aby
+
+    return math.hypot(px - cx, py - cy) <= r
+
+
+def rect_hit(bounds, p, r):
+    left, top, right, bottom = bounds
+    tl = left, top
+    tr = right, top
+    bl = left, bottom
+    br = right, bottom
+
+    return (
+        line_hit(tl, tr, p, r)
+        or line_hit(tr, br, p, r)
+        or line_hit(br, bl, p, r)
+        or line_hit(bl, tl, p, r)
+    )
+
+
+@benchmark("erase")
+def bench_erase(window, args):
+    canva = window.canva
+    rng = random.Random(args.seed)
+    r = 15
+
+    for count in (1_000, 10_000, 100_000):
+        canva.strokes = [random_free_stroke(rng) for _ in range(count)]
+        canva.rebuild_index()
+        positions = random_positions(rng, args.repeat)
+
+        # the eraser's own path: cut every stroke the dab reaches. Without the
+        # index a dab costs seconds on big boards, a few of them are enough
+        sample = positions[: max(3, len(positions) * 1_000 // count)]
+
+        def linear():
+            for pos in sample:
+                x, y = pos.x(), pos.y()
+                [canva.split_stroke(s, x, y, r) for s in canva.strokes]
+
+        def indexed():
+            reach = math.ceil(r)
+            for pos in positions:
+                x, y = pos.x(), pos.y()
+                bounds = (x - reach, y - reach, x + reach, y + reach)
+                candidates = canva.stroke_index.query(bounds)
+                [canva.split_stroke(s, x, y, r) for s in candidates]
+
+        linear_ms = timed(linear, 1) / len(sample)
+        indexed_ms = timed(indexed, 1) / len(positions)
+        print(
+            f"erase {count:>7} strokes  linear {linear_ms:9.3f} ms  "
+            f"indexed {indexed_ms:7.3f} ms  x{linear_ms / indexed_ms:.0f}"
+        )
+
+    canva.strokes = []
+    canva.rebuild_index()
+
+
+@benchmark("hit")
+def bench_hit(window, args):
+    canva = window.canva
+    rng = random.Random(args.seed)
+
+    # the per-point checks the vectorized tests replaced
+    def sample_hit(s, pos, r):
+        return any(math.hypot(p.x() - pos.x(), p.y() - pos.y()) < r for p in s.points())
+
+    def sample_intersect(s, rect):
+        return any(rect.contains(p) for p in s.points())
+
+    for points in (8, 64, 512):
+        corpus = [random_free_stroke(rng, points=points, step=24) for _ in range(200)]
+        positions = random_positions(rng, args.repeat)
+        rects = [
+            QRect(p, p + QPoint(rng.randint(0, 400), rng.randint(0, 400)))
+            for p in positions
+        ]
+        r = 15
+
+        erased = [[stroke_hit(s, p, r) for s in corpus] for p in positions]
+        sampled = [[sample_hit(s, p, r) for s in corpus] for p in positions]
+        missed = sum(
+            new and not old
+            for row_new, row_old in zip(erased, sampled)
+            for new, old in zip(row_new, row_old)
+        )
+        lost = sum(
+            old and not new
+            for row_new, row_old in zip(erased, sampled)
+            for new, old in zip(row_new, row_old)
+        )
+
+        cropped = [[canva.stroke_intersect_rect(s, q) for s in corpus] for q in rects]
+        reference = [[sample_intersect(s, q) for s in corpus] for q in rects]
+        assert lost == 0, "eraser dropped a hit the sample test found"
+        assert cropped == reference, "crop eraser results changed"
+
+        def python_erase():
+            for p in positions:
+                [sample_hit(s, p, r) for s in corpus]
+
+        def numpy_erase():
+            for p in positions:
+                [stroke_hit(s, p, r) for s in corpus]
+
+        python_ms = timed(python_erase, 1) / len(positions) / len(corpus) * 1000
+        numpy_ms = timed(numpy_erase, 1) / len(positions) / len(corpus) * 1000
+        print(
+            f"hit {points:>4} pts/stroke  python {python_ms:8.2f} us  "
+            f"numpy {numpy_ms:6.2f} us  segment-only hits {missed}"
+        )
+
+
+@benchmark("memory")
+def bench_memory(window, args):
+    rng = random.Random(args.seed)
+    walks = [random_walk(rng, points=200) for _ in range(2_000)]
+    count = sum(len(xy) for xy in walks)
+
+    # dict + QPoint list strokes, as committed before the Stroke type
+    def build_dicts():
+        return [
+            {
+                "shape": "free",
+                "color": QColor(255, 255, 255),
+                "size": 4,
+                "round_cap": True,
+                "points": [QPoint(x, y) for x, y in xy],
+            }
+            for xy in walks
+        ]
+
+    def build_strokes():
+        return [Stroke("free", WHITE, 4, True, xy) for xy in walks]
+
+    strokes, packed = allocated_bytes(build_strokes)
+    dicts, loose = allocated_bytes(build_dicts)
+    print(
+        f"memory {count} points  dict+QPoint {loose / count:6.1f} B/pt  "
+        f"Stroke {packed / count:5.1f} B/pt"
+    )
+
+
+@benchmark("simplify")
+def bench_simplify(window, args):
+    canva = window.canva
+    rng = random.Random(args.seed)
+
+    if args.drawing:
+        window.controller.read_json(args.drawing)
+        window.controller.wait_task()
+        recorded = [
+            s.points() for s in canva.strokes if s.shape == "free" and len(s.xy) > 1
+        ]
+        canva.clear()
+    else:
+        recorded = [recorded_stroke(rng) for _ in range(100)]
+
+    brush = window.controller.get_brush()
+    raw = [Stroke.free(brush, pts) for pts in recorded]
+    before = sum(len(s.xy) for s in raw)
+
+    for tolerance in (0.5, 0.75, 1, 2):
+        start = time.perf_counter()
+        simple = [Stroke.free(brush, pts, tolerance) for pts in recorded]
+        ms = (time.perf_counter() - start) * 1000 / len(recorded)
+
+        after = sum(len(s.xy) for s in simple)
+        errors = [curve_deviation(a.xy, b.xy) for a, b in zip(raw, simple)]
+        print(
+            f"simplify tolerance {tolerance:4} px  points {before} -> {after} "
+            f"(-{100 * (1 - after / before):.0f}%)  deviation max "
+            f"{max(errors):.2f} px p99 {np.percentile(errors, 99):.2f} px  "
+            f"{ms:.2f} ms/stroke"
+        )
+
+    print(f"simplify default tolerance {canva.simplify_tolerance} px")
+
+
+def session_signature(canva):
+    def sig(s):
+        return s.shape, s.rgba, s.size, s.round_cap, s.layer, s.xy.tobytes()
+
+    steps = [
+        [(type(op).__name__, [sig(s) for s in op_strokes(op)]) for op in step]
+        for step in canva.history.steps
+    ]
+    base = [sig(s) for s in canva.history.base(canva.strokes)]
+    layers = [layer.state() for layer in canva.layers]
+    return canva.board_color, canva.history.index, layers, base, steps
+
+
+def op_strokes(op):
+    if isinstance(op, AddStroke):
+        return [op.stroke]
+    elif isinstance(op, RemoveStrokes):
+        return [s for _, s in op.removed]
+    elif isinstance(op, SplitStroke):
+        return [op.stroke, *op.pieces]
+    return list(op.strokes)
+
+
+@benchmark("archive")
+def bench_archive(window, args):
+    canva = window.canva
+    rng = random.Random(args.seed)
+
+    # strokes spread over a translucent and a locked layer
+    canva.add_layer("Notes")
+    canva.set_layer_opacity(1, 0.5)
+    canva.set_layer_locked(1, True)
+
+    board = []
+    steps = []
+    for _ in range(args.board):
+        xy = random_walk(rng, 500)
+        op = AddStroke(Stroke("free", WHITE, 4, True, xy, layer=rng.randrange(2)))
+        op.apply(board)
+        steps.append([op])
+    for _ in range(args.board // 10):
+        i = rng.randrange(len(board))
+        op = RemoveStrokes(((i, board[i]),))
+        op.apply(board)
+        steps.append([op])
+    for _ in range(args.board // 10):
+        i = rng.randrange(len(board))
+        s = board[i]
+        pieces = (
+            Stroke(s.shape, s.rgba, s.size, s.round_cap, xy, layer=s.layer)
+            for xy in np.array_split(s.xy, 3)
+        )
+        op = SplitStroke(i, s, tuple(pieces))
+        op.apply(board)
+        steps.append([op])
+
+    load_board(canva, board)
+    for step in steps:
+        canva.history.push(step)
+
+    # leave one step to redo
+    canva.history.undo()
+    steps[-1][0].revert(canva.strokes)
+    canva.rebuild_index()
+
+    expected = session_signature(canva)
+    folder = tempfile.mkdtemp()
+    paths = {
+        "json": os.path.join(folder, "drawing.json"),
+        "archive": os.path.join(folder, "drawing.spen"),
+    }
+
+    # the worker side of Controller.write_* / read_*, without the repaint
+    def save(kind):
+        if kind == "json":
+            save_session(paths[kind], *canva.snapshot())
+        else:
+            write_archive(paths[kind], *canva.snapshot())
+
+    def load(kind):
+        if kind == "json":
+            canva.load_session(*load_session(paths[kind]))
+        else:
+            canva.load_session(*read_archive(paths[kind]))
+
+    for kind in paths:
+        save_ms = timed(lambda: save(kind), 1)
+        load_ms = timed(lambda: load(kind), 3)
+
+        # python heap only, mapped points are paged in on use
+        load_board(canva, [])
+        tracemalloc.start()
+        load(kind)
+        loaded = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        if session_signature(canva) != expected:
+            print(f"archive {kind} round trip FAILED")
+            sys.exit(1)
+
+        print(
+            f"archive {kind:7}  {os.path.getsize(paths[kind]) / 1e6:6.2f} MB  "
+            f"save {save_ms:7.1f} ms  load {load_ms:7.1f} ms  "
+            f"load heap {loaded / 1e6:6.1f} MB  round trip ok"
+        )
+
+    # back to an empty board with the default layer
+    canva.load_session({}, [], [])
+    for path in paths.values():
+        os.remove(path)
+
+
+@benchmark("journal")
+def bench_journal(window, args):
+    canva = window.canva
+    rng = random.Random(args.seed)
+    load_board(canva, [])
+
+    path = os.path.join(tempfile.mkdtemp(), "journal.jsonl")
+    canva.journal = Journal(path, canva.snapshot)
+    canva.journal.start()
+
+    # a long session: strokes, erases and undo / redo, as Canva records them
+    record_ns = []
+    for i in range(args.board):
+        k = rng.random()
+        start = time.perf_counter_ns()
+
+        if k < 0.8 or not canva.strokes:
+            op = AddStroke(random_free_stroke(rng, 200))
+            op.apply(canva.strokes)
+            start = time.perf_counter_ns()
+            canva.push_step([op])
+
+        elif k < 0.9:
+            j = rng.randrange(len(canva.strokes))
+            op = RemoveStrokes(((j, canva.strokes[j]),))
+            op.apply(canva.strokes)
+            start = time.perf_counter_ns()
+            canva.push_step([op])
+
+        elif k < 0.95:
+            step = canva.history.undo()
+            if step:
+                for op in reversed(step):
+                    op.revert(canva.strokes)
+                canva.journal.undo()
+
+        else:
+            step = canva.history.redo()
+            if step:
+                for op in step:
+                    op.apply(canva.strokes)
+                canva.journal.redo()
+
+        record_ns.append(time.perf_counter_ns() - start)
+
+    expected = session_signature(canva)
+
+    # close waits for the writer to drain and fsync
+    start = time.perf_counter()
+    canva.journal.close()
+    drain_ms = (time.perf_counter() - start) * 1000
+    canva.journal = None
+    size = os.path.getsize(path)
+
+    def recover():
+        canva.load_session(*read_journal(path))
+
+    replay_ms = timed(recover, 3)
+    replayed = session_signature(canva) == expected
+
+    # the same board as one compacted session
+    save_session(path, *canva.snapshot())
+    compact_ms = timed(recover, 3)
+    compacted = session_signature(canva) == expected
+
+    if not (replayed and compacted):
+        print("journal recovery FAILED")
+        sys.exit(1)
+
+    record_ns.sort()
+    print(
+        f"journal  {args.board} records  GUI thread p50 "
+        f"{record_ns[len(record_ns) // 2] / 1000:.1f} us  "
+        f"p99 {record_ns[len(record_ns) * 99 // 100] / 1000:.1f} us  "
+        f"drain on quit {drain_ms:.1f} ms"
+    )
+    print(
+        f"journal  {size / 1e6:.2f} MB  recover {replay_ms:.1f} ms  "
+        f"compacted {os.path.getsize(path) / 1e6:.2f} MB  recover {compact_ms:.1f} ms  "
+        f"round trip ok"
+    )
+
+    load_board(canva, [])
+    os.remove(path)
+
+
+@benchmark("input")
+def bench_input(window, args):
+    app = QApplication.instance()
+    canva = window.canva
+    rng = random.Random(args.seed)
+    load_board(canva, [random_free_stroke(rng, 50) for _ in range(args.board)])
+
+    # two seconds of a 1000 Hz mouse, sub-pixel steps
+    rate = 1000
+    w, h = canva.width(), canva.height()
+    y = rng.uniform(h / 4, h * 3 / 4)
+    points = [
+        QPointF(50 + i * (w - 100) / (2 * rate), y + 100 * math.sin(i / 150))
+        for i in range(2 * rate)
+    ]
+
+    # the old path: overlay, stroke and update for every event
+    def per_event(pos):
+        canva.mouse_pos = pos.toPoint()
+        canva.overlay.move_cursor(canva.mouse_pos)
+        canva.move_stroke_to([canva.to_world(pos)])
+
+    def coalesced(pos):
+        canva.pointer_move(pos, Qt.LeftButton)
+
+    def paints():
+        return canva.profiler.stats.get("Canva.paintEvent", [0])[0]
+
+    def replay(deliver):
+        send_mouse(canva, QEvent.MouseButtonPress, points[0])
+        canva.profiler.start()
+        before = paints()
+
+        cpu = time.process_time()
+        start = time.perf_counter()
+        for i, pos in enumerate(points):
+            due = start + i / rate
+            while time.perf_counter() < due:
+                time.sleep(0.0002)
+            deliver(pos)
+            app.processEvents()
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - start
+
+        send_mouse(canva, QEvent.MouseButtonRelease, points[-1])
+        app.processEvents()
+        canva.profiler.stop()
+        return paints() - before, cpu, wall, canva.strokes[-1]
+
+    def flood(deliver):
+        send_mouse(canva, QEvent.MouseButtonPress, points[0])
+        start = time.perf_counter()
+        for pos in points:
+            deliver(pos)
+        canva.flush_moves()
+        app.processEvents()
+        elapsed = time.perf_counter() - start
+        send_mouse(canva, QEvent.MouseButtonRelease, points[-1])
+        app.processEvents()
+        return len(points) / elapsed
+
+    results = {}
+    for name, deliver in (("per event", per_event), ("coalesced", coalesced)):
+        paint_count, cpu, wall, stroke = replay(deliver)
+        rate_flood = flood(deliver)
+        results[name] = stroke.xy
+
+        print(
+            f"input {name:9}  1000 Hz for {wall:.2f} s: {paint_count:5} paints  "
+            f"CPU {cpu / wall:6.1%}  flood {rate_flood:8.0f} events/s"
+        )
+
+    same = np.array_equal(results["per event"], results["coalesced"])
+    print(f"input  coalesced stroke matches per-event stroke: {same}")
+    if not same:
+        sys.exit(1)
+
+    load_board(canva, [])
+
+
+@benchmark("hover")
+def bench_hover(window, args):
+    # eraser ring following the mouse over a full board, no button held
+    app = QApplication.instance()
+    canva = window.canva
+    rng = random.Random(args.seed)
+    load_board(canva, [random_free_stroke(rng, 50) for _ in range(args.board)])
+
+    window.controller.set_tool("eraser")
+    points = sweep(rng, canva.width(), canva.height(), 500)
+    stats = canva.profiler.stats
+
+    def count(label):
+        return stats.get(label, [0])[0]
+
+    def hover():
+        for pos in points:
+            canva.pointer_move(QPointF(pos), Qt.NoButton)
+            canva.flush_moves()
+            app.processEvents()
+
+    hover()  # tiles built
+    canva.profiler.start()
+    labels = (
+        "Canva.paintEvent",
+        "Overlay.paintEvent",
+        "Canva.draw_strokes",
+    )
+    before = {label: count(label) for label in labels}
+    ms = timed(hover, 1) / len(points)
+    canva.profiler.stop()
+
+    calls = "  ".join(f"{label} {count(label) - before[label]}" for label in labels)
+    print(f"hover  {len(points)} moves  {ms * 1000:6.0f} us/move  {calls}")
+
+    window.controller.set_tool("pen")
+    canva.overlay.move_cursor(None)
+    load_board(canva, [])
+
+
+@benchmark("render")
+def bench_render(window, args):
+    canva = window.canva
+    rng = random.Random(args.seed)
+
+    # styles change every few strokes, like a person picking tools
+    styles = [
+        (QColor(255, 255, 255).rgba(), 4, True),
+        (QColor(248, 49, 47).rgba(), 6, True),
+        (QColor(0, 166, 237).rgba(), 10, True),
+        (QColor(255, 176, 46, 80).rgba(), 14, False),
+    ]
+
+    def random_board(count):
+        board = []
+        while len(board) < count:
+            rgba, size, round_cap = rng.choice(styles)
+            for _ in range(rng.randint(1, 30)):
+                shape = rng.choices(("free", "line", "rect"), (8, 1, 1))[0]
+                if shape == "free":
+                    xy = random_walk(rng, 30, 8)
+                else:
+                    x, y = rng.randrange(BOARD_WIDTH), rng.randrange(BOARD_HEIGHT)
+                    xy = [(x, y), (x + rng.randint(5, 200), y + rng.randint(5, 200))]
+                board.append(Stroke(shape, rgba, size, round_cap, xy))
+        return board[:count]
+
+    # Canva.draw_stroke before style runs: a new pen and a call per stroke
+    def draw_each(painter, strokes):
+        zoom = painter.worldTransform().m11()
+        for s in strokes:
+            pen = QPen(s.color)
+            pen.setWidth(s.size)
+            pen.setCapStyle(Qt.RoundCap if s.round_cap else Qt.FlatCap)
+            painter.setPen(pen)
+
+            if s.shape == "free":
+                painter.drawPath(s.lod_path(zoom))
+            elif s.shape == "line":
+                (x0, y0), (x1, y1) = s.xy.tolist()
+                painter.drawLine(x0, y0, x1, y1)
+            else:
+                painter.drawRect(s.qrect())
+
+    # opaque runs as one merged path, what a batched stroker would do
+    def draw_merged(painter, strokes):
+        for style, run in groupby(strokes, key=lambda s: s.style):
+            painter.setPen(canva.style_pen(style))
+            run = list(run)
+            if style[0] >> 24 == 255:
+                path = QPainterPath()
+                for s in run:
+                    path.addPath(s.path())
+                painter.drawPath(path)
+            else:
+                canva.draw_strokes(painter, run)
+
+    def paint(draw, strokes, image):
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        draw(painter, strokes)
+        painter.end()
+
+    def pixels(image):
+        data = np.frombuffer(image.constBits(), np.uint8)
+        return data.reshape(image.height(), -1).astype(np.int16)
+
+    for count in (1_000, 5_000, 20_000):
+        board = random_board(count)
+        runs = sum(1 for _ in groupby(board, key=lambda s: s.style))
+        for s in board:
+            s.path()
+
+        image = QImage(BOARD_WIDTH, BOARD_HEIGHT, QImage.Format_ARGB32_Premultiplied)
+        each_ms = timed(lambda: paint(draw_each, board, image), 2)
+        reference = pixels(image)
+
+        line = f"render {count:6} strokes {runs:4} runs  per stroke {each_ms:7.1f} ms"
+        for name, draw in (("by style", canva.draw_strokes), ("merged", draw_merged)):
+            ms = timed(lambda: paint(draw, board, image), 2)
+            diff = np.abs(pixels(image) - reference).max()
+            line += f"  {name} {ms:7.1f} ms (diff {diff:3})"
+        print(line)
+
+
+@benchmark("split")
+def bench_split(window, args):
+    # eraser clicks on long strokes: cut out the dab or drop the stroke;
+    # then drags along strokes, where the eraser keeps cutting its own pieces
+    app = QApplication.instance()
+    canva = window.canva
+    controller = window.controller
+    rng = random.Random(args.seed)
+    width, height = canva.width(), canva.height()
+
+    def long_stroke():
+        # a wandering pen line, turned back at the window edges
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        heading = rng.uniform(0, 2 * math.pi)
+        xy = []
+        for _ in range(300):
+            heading += rng.gauss(0, 0.15)
+            x += 4 * math.cos(heading)
+            y += 4 * math.sin(heading)
+            if not 0 <= x < width:
+                heading = math.pi - heading
+                x = min(max(x, 0), width - 1)
+            if not 0 <= y < height:
+                heading = -heading
+                y = min(max(y, 0), height - 1)
+            xy.append((round(x), round(y)))
+        return Stroke("free", WHITE, 6, True, xy)
+
+    board = [long_stroke() for _ in range(60)]
+    dabs = []
+    for _ in range(100):
+        x, y = rng.choice(board).xy[rng.randrange(300)].tolist()
+        dabs.append(QPointF(x, y))
+
+    controller.set_tool("eraser")
+    controller.set_size(30)
+    r = controller.get_brush().size / 2
+
+    def split(pos):
+        canva.move_stroke_to([pos])
+
+    def whole(pos):
+        reach = math.ceil(r)
+        x, y = pos.x(), pos.y()
+        candidates = canva.stroke_index.query(
+            (x - reach, y - reach, x + reach, y + reach)
+        )
+        hits = [s for s in candidates if stroke_hit(s, pos, r)]
+        if hits:
+            canva.remove_strokes(hits)
+
+    def tiles():
+        return sum(len(layer.tiles) for layer in canva.layers)
+
+    # every dab on the full board, undone untimed before the next one
+    for name, erase in (("whole", whole), ("split", split)):
+        load_board(canva, board)
+        canva.repaint()
+
+        samples = []
+        dropped = 0
+        added = 0
+        history = 0
+        for pos in dabs:
+            count = len(canva.strokes)
+            start = time.perf_counter()
+            canva.begin_stroke(pos, controller.get_brush())
+            before = tiles()
+            erase(pos)
+            canva.end_stroke()
+            dropped += before - tiles()
+            canva.repaint()
+            samples.append((time.perf_counter() - start) * 1000)
+
+            added += len(canva.strokes) - count
+            history += step_nbytes(canva.history.steps[canva.history.index - 1])
+            controller.undo()
+            canva.repaint()
+
+        # the last dab again, the cached tiles against a full rebuild
+        canva.begin_stroke(dabs[-1], controller.get_brush())
+        erase(dabs[-1])
+        canva.end_stroke()
+        canva.repaint()
+        cached = canva.grab().toImage()
+        canva.invalidate_cache()
+        canva.repaint()
+        same = cached == canva.grab().toImage()
+
+        n = len(dabs)
+        print(
+            f"split {name:5}  {n} dabs  p50 {np.percentile(samples, 50):6.2f} ms  "
+            f"p99 {np.percentile(samples, 99):6.2f} ms  tiles redrawn "
+            f"{dropped / n:5.1f}/dab  strokes {added / n:+5.2f}/dab  "
+            f"history {history / n / 1e3:5.1f} kB/dab  "
+            f"tiles {'match' if same else 'DIFFER'}"
+        )
+        if not same:
+            sys.exit(1)
+
+    # half of a stroke erased in one drag, a move every 4 points
+    load_board(canva, board)
+    canva.repaint()
+    expected = list(canva.strokes)
+
+    samples = []
+    ops = 0
+    history = 0
+    touched = 0  # the strokes the drags started from
+    for s in board[:10]:
+        path = [QPointF(x, y) for x, y in s.xy[: len(s.xy) // 2 : 4].tolist()]
+        canva.begin_stroke(path[0], controller.get_brush())
+        for pos in path:
+            start = time.perf_counter()
+            canva.move_stroke_to([pos])
+            canva.repaint()
+            samples.append((time.perf_counter() - start) * 1000)
+        canva.end_stroke()
+
+        step = canva.history.steps[canva.history.index - 1]
+        ops += len(step)
+        history += step_nbytes(step)
+        touched += sum(
+            op.stroke.nbytes if isinstance(op, SplitStroke) else op.nbytes
+            for op in step
+        )
+
+    cached = canva.grab().toImage()
+    canva.invalidate_cache()
+    canva.repaint()
+    same = cached == canva.grab().toImage()
+
+    for _ in range(10):
+        controller.undo()
+    same = same and canva.strokes == expected
+
+    print(
+        f"split drag   10 drags  {len(samples)} moves  p50 "
+        f"{np.percentile(samples, 50):6.2f} ms  p99 {np.percentile(samples, 99):6.2f} ms  "
+        f"ops {ops / 10:4.1f}/drag  history {history / 10 / 1e3:5.1f} kB/drag "
+        f"({history / touched:4.2f}x the strokes cut)  "
+        f"{'tiles match, undo ok' if same else 'FAILED'}"
+    )
+    if not same:
+        sys.exit(1)
+
+    # undo pressed halfway through a drag: the cuts so far become a step
+    # and are undone, the rest of the drag erases nothing
+    s = board[0]
+    path = [QPointF(x, y) for x, y in s.xy[: len(s.xy) // 2 : 4].tolist()]
+    index = canva.history.index
+    canva.begin_stroke(path[0], controller.get_brush())
+    for pos in path[: len(path) // 2]:
+        canva.move_stroke_to([pos])
+    controller.undo()
+    for pos in path[len(path) // 2 :]:
+        canva.move_stroke_to([pos])
+    canva.end_stroke()
+    same = canva.strokes == expected and canva.history.index == index
+
+    # the cuts are one step to redo and undo again
+    controller.redo()
+    same = same and canva.strokes != expected
+    controller.undo()
+    same = same and canva.strokes == expected
+    print(f"split drag   undo mid-drag  {'history ok' if same else 'FAILED'}")
+    if not same:
+        sys.exit(1)
+
+    controller.set_tool("pen")
+    load_board(canva, [])
+
+
+@benchmark("resident")
+def bench_resident(window, args):
+    # main.py in a child process: cold start vs showing the warm daemon
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    folder = tempfile.mkdtemp()
+    name = f"screen-pen-bench-{os.getpid()}"
+    base = [sys.executable, main, "--socket", name, "--no-restore"]
+    base += ["--journal", os.path.join(folder, "journal.jsonl")]
+
+    def wait_ready(process, state):
+        start = time.perf_counter()
+        while send_command("ping", name, timeout=50) != state:
+            if process.poll() is not None:
+                raise RuntimeError("main.py exited during start")
+            time.sleep(0.005)
+        return (time.perf_counter() - start) * 1000
+
+    def median(values):
+        return sorted(values)[len(values) // 2]
+
+    # what every use cost before: a new process up to a visible board
+    colds = []
+    for _ in range(3):
+        process = subprocess.Popen(base + ["--send", "show"], stderr=subprocess.DEVNULL)
+        colds.append(wait_ready(process, "visible"))
+        send_command("quit", name)
+        process.wait()
+
+    process = subprocess.Popen(base + ["--resident"], stderr=subprocess.DEVNULL)
+    wait_ready(process, "hidden")
+
+    shows = []
+    hides = []
+    for _ in range(20):
+        for command, times in (("show", shows), ("hide", hides)):
+            start = time.perf_counter()
+            send_command(command, name)
+            times.append((time.perf_counter() - start) * 1000)
+
+    # a hotkey running the CLI client, interpreter start included
+    clients = []
+    for _ in range(5):
+        start = time.perf_counter()
+        subprocess.run(
+            base + ["--send", "toggle"], stdout=subprocess.DEVNULL, check=True
+        )
+        clients.append((time.perf_counter() - start) * 1000)
+
+    send_command("quit", name)
+    process.wait()
+
+    print(f"resident  cold start to visible board  {median(colds):7.1f} ms")
+    print(
+        f"resident  warm show {median(shows):5.2f} ms  hide {median(hides):5.2f} ms  "
+        f"CLI toggle {median(clients):6.1f} ms (median)"
+    )
+
+
+@benchmark("toolbar")
+def bench_toolbar(window, args):
+    from toolbar import Toolbar
+
+    app = QApplication.instance()
+    controller = window.controller
+
+    def build():
+        toolbar = Toolbar(window, controller)
+        toolbar.show()
+        app.processEvents()
+        toolbar.deleteLater()
+
+    build_ms = timed(build, 20)
+
+    ticks = iter(range(10**9))
+
+    def wheel():
+        i = next(ticks)
+        controller.adjust_size(1 if i % 10 < 5 else -1, QPoint())
+        app.processEvents()
+
+    def switch():
+        controller.set_tool(("pen", "highlight", "eraser")[next(ticks) % 3])
+        app.processEvents()
+
+    wheel_ms = timed(wheel, 200)
+    switch_ms = timed(switch, 200)
+    controller.set_tool("pen")
+
+    print(
+        f"toolbar  build {build_ms:6.2f} ms  "
+        f"wheel tick {wheel_ms:6.3f} ms  tool switch {switch_ms:6.3f} ms"
+    )
+
+
+@benchmark("zoom")
+def bench_zoom(window, args):
+    app = QApplication.instance()
+    canva = window.canva
+    rng = random.Random(args.seed)
+
+    board = []
+    for _ in range(args.board):
+        xy = np.array([(p.x(), p.y()) for p in recorded_stroke(rng)], dtype=np.int32)
+        board.append(Stroke("free", WHITE, 4, True, simplify_polyline(xy, 0.5)))
+    load_board(canva, board)
+
+    # every stroke drawn the way Canva.draw_strokes does, with or without LOD
+    def paint(lod):
+        image = QImage(canva.size(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        canva.apply_view(painter)
+        for s in canva.strokes:
+            pen = QPen(s.color)
+            pen.setWidth(s.size)
+            pen.setCapStyle(Qt.RoundCap)
+            painter.setPen(pen)
+            painter.drawPath(s.lod_path(canva.view_scale) if lod else s.path())
+        painter.end()
+
+    # board centered in the window at 1x, 1/2x, 1/4x and 1/8x
+    for steps in (0, -4, -8, -12):
+        canva.reset_view()
+        canva.zoom_view(steps, QPoint())
+        s = canva.view_scale
+        center = QPoint(int(BOARD_WIDTH * s / 2), int(BOARD_HEIGHT * s / 2))
+        canva.pan_view(center - canva.rect().center())
+        app.processEvents()
+        paint(True)
+
+        zoom_ms = timed(lambda: (canva.invalidate_cache(), canva.repaint()), 3)
+        pan_ms = timed(lambda: (canva.pan_view(QPoint(16, 0)), canva.repaint()), 10)
+        full_ms = timed(lambda: paint(False), 3)
+        lod_ms = timed(lambda: paint(True), 3)
+
+        elements = sum(x.lod_path(s).elementCount() for x in canva.strokes)
+        print(
+            f"zoom {s:6.3f}x  rebuild {zoom_ms:7.1f} ms  pan {pan_ms:6.1f} ms  "
+            f"paint full {full_ms:7.1f} ms  lod {lod_ms:7.1f} ms  "
+            f"path elements {elements}"
+        )
+
+    canva.reset_view()
+    load_board(canva, [])
+
+
+# interaction suite
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        yield
+        ms = (time.perf_counter() - start) * 1000
+        self.samples.setdefault(name, []).append(ms)
+
+    def report(self):
+        ops = {}
+        for name, values in self.samples.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            ops[name] = {
+                "count": len(values),
+                "p50": round(float(p50), 4),
+                "p90": round(float(p90), 4),
+                "p99": round(float(p99), 4),
+                "max": round(max(values), 4),
+            }
+        return ops
+
+
+def send_mouse(widget, kind, pos, button=Qt.LeftButton):
+    buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else Qt.LeftButton
+    if kind == QEvent.MouseMove:
+        button = Qt.NoButton
+
+    event = QMouseEvent(kind, QPointF(pos), button, buttons, Qt.NoModifier)
+    QApplication.sendEvent(widget, event)
+
+
+def drag(window, rec, name, points, release_name=None):
+    app = QApplication.instance()
+    canva = window.canva
+
+    send_mouse(canva, QEvent.MouseButtonPress, points[0])
+    app.processEvents()
+
+    for pos in points[1:]:
+        with rec.time(name):
+            send_mouse(canva, QEvent.MouseMove, pos)
+            app.processEvents()
+
+    with rec.time(release_name or f"{name}_release"):
+        send_mouse(canva, QEvent.MouseButtonRelease, points[-1])
+        app.processEvents()
+
+
+def load_board(canva, strokes):
+    canva.strokes = list(strokes)
+    canva.rebuild_index()
+    canva.invalidate_cache()
+    canva.history.clear()
+    canva.update()
+    QApplication.instance().processEvents()
+
+
+def sweep(rng, width, height, count):
+    y = rng.randrange(height)
+    return [
+        QPoint(int(i * width / count), int(y + 200 * math.sin(i / 40)))
+        for i in range(count)
+    ]
+
+
+@benchmark("suite")
+def bench_suite(window, args):
+    app = QApplication.instance()
+    canva = window.canva
+    controller = window.controller
+    rng = random.Random(args.seed)
+    rec = Recorder()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    window.showNormal()
+    window.setGeometry(0, 0, width, height)
+    app.processEvents()
+
+    def board_stroke():
+        s = random_free_stroke(rng, points=24, step=12)
+        xy = s.xy % (width, height)
+        return Stroke("free", s.rgba, s.size, s.round_cap, xy)
+
+    # long freehand strokes
+    controller.set_pen()
+    for _ in range(args.strokes):
+        x, y = rng.randrange(width), rng.randrange(height)
+        pts = [
+            QPoint(int(x + 300 * math.sin(i / 90)), int(y + 200 * math.cos(i / 70)))
+            for i in range(args.stroke_length)
+        ]
+        drag(window, rec, "freehand_move", pts, "freehand_release")
+
+    # undo / redo chains
+    for _ in range(args.strokes):
+        with rec.time("undo"):
+            controller.undo()
+            app.processEvents()
+    for _ in range(args.strokes):
+        with rec.time("redo"):
+            controller.redo()
+            app.processEvents()
+
+    # dense boards
+    load_board(canva, [board_stroke() for _ in range(args.board)])
+
+    canva.invalidate_cache()
+    with rec.time("paint_rebuild"):
+        canva.repaint()
+    for _ in range(20):
+        with rec.time("paint_cached"):
+            canva.repaint()
+
+    controller.set_tool("eraser")
+    for _ in range(5):
+        drag(window, rec, "erase_move", sweep(rng, width, height, 400))
+
+    controller.set_tool("crop_eraser")
+    for _ in range(20):
+        x, y = rng.randrange(width - 300), rng.randrange(height - 300)
+        pts = [QPoint(x + i * 30, y + i * 30) for i in range(11)]
+        drag(window, rec, "crop_move", pts, "crop_release")
+
+    # export / import
+    path = os.path.join(tempfile.mkdtemp(), "drawing.json")
+    for _ in range(3):
+        with rec.time("export_json"):
+            with rec.time("export_json_blocking"):
+                controller.write_json(path)
+            with rec.time("paint_during_export"):
+                canva.repaint()
+            controller.wait_task()
+        with rec.time("import_json"):
+            controller.read_json(path)
+            controller.wait_task()
+    os.remove(path)
+
+    # clear
+    for _ in range(5):
+        with rec.time("clear"):
+            controller.clear()
+            app.processEvents()
+        with rec.time("undo_clear"):
+            controller.undo()
+            app.processEvents()
+
+    # png save
+    path = os.path.join(tempfile.mkdtemp(), "screenshot.png")
+    for back in ("desktop", "black", "trans"):
+        for _ in range(3):
+            with rec.time(f"save_png_{back}"):
+                with rec.time(f"save_png_{back}_blocking"):
+                    controller.save(back, path=path)
+                controller.wait_task()
+    with rec.time("save_png_crop"):
+        controller.save("trans", crop=True, path=path)
+        controller.wait_task()
+    os.remove(path)
+
+    controller.set_pen()
+    load_board(canva, [])
+
+    peak = peak_rss_bytes()
+    result = {
+        "app": "Desktop-screen-pen",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size": args.size,
+        "board": args.board,
+        "ops": rec.report(),
+        "peak_rss_mb": round(peak / 2**20, 1) if peak else None,
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        check_baseline(result, args.baseline, args.max_regression)
+
+
+def check_baseline(result, path, max_regression):
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    failed = []
+    for name, stats in result["ops"].items():
+        base = baseline.get("ops", {}).get(name)
+        if not base:
+            continue
+
+        for key in ("p50", "p90"):
+            limit = base[key] * (1 + max_regression)
+            if stats[key] > limit:
+                failed.append(
+                    f"{name} {key} {stats[key]:.3f} ms > {limit:.3f} ms "
+                    f"(baseline {base[key]:.3f} ms)"
+                )
+
+    for line in failed:
+        print(f"regression: {line}", file=sys.stderr)
+
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Desktop-screen-pen benchmarks")
+    parser.add_argument("names", nargs="*", help=f"any of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drawing", help="exported drawing JSON to take strokes from")
+    parser.add_argument("--size", default="1920x1080", help="suite window size")
+    parser.add_argument("--board", type=int, default=2_000, help="suite board strokes")
+    parser.add_argument("--strokes", type=int, default=10)
+    parser.add_argument("--stroke-length", type=int, default=1_000)
+    parser.add_argument("--json", help="write the suite report to this file")
+    parser.add_argument("--baseline", help="suite report to gate regressions against")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args()
+
+    window = make_window()
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](window, args)
+
+
+if __name__ == "__main__":
+    main()
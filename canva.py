@@ -1,15 +1,28 @@
 # canva.py
 # type: ignore
 
-from PySide2.QtGui import QColor, QPainter, QPen
-from PySide2.QtCore import Qt, QPoint, QRect
-from PySide2.QtGui import QPainterPath
+from PySide2.QtGui import QColor, QPainter, QPen, QImage, QPainterPath
+from PySide2.QtCore import Qt, QEvent, QPoint, QPointF, QRect, QRectF, QTimer
 from PySide2.QtWidgets import QWidget
-from PySide2.QtGui import QFont
-import copy
+from dataclasses import replace
+from itertools import groupby
 import math
+import time
+
+import numpy as np
 
 from controller import BrushState
+from geometry import array_bounds, any_point_in_rect, any_segment_in_rect
+from geometry import clip_polyline_circle
+from spatial import GridIndex, bounds_overlap
+from layers import Layer, default_layers
+from tiles import rect_bounds
+from stroke import Stroke
+from history import History, AddStroke, RemoveStrokes, ClearStrokes, SplitStroke
+
+# zoom steps of a quarter octave, 1/16x to 4x
+ZOOM_STEPS = 4
+ZOOM_RANGE = (-16, 8)
 
 
 class Canva(QWidget):
@@ -25,131 +38,229 @@ class Canva(QWidget):
         self.current_brush: BrushState | None = None
         self.start_pos: QPoint | None = None
         self.last_pos: QPoint | None = None
-        self.current_points: list[QPoint] = []
-        self.strokes: list[dict] = []
+        self.current_points: list[QPointF] = []  # board, sub-pixel
+        self.simplify_tolerance = 0.5
+        self.strokes: list[Stroke] = []
+
+        # screen = board * view_scale - view_pan
+        self.view_scale = 1.0
+        self.view_pan = QPoint()
+        self._pan_from: QPoint | None = None
+
+        # pointer moves are handled once per frame, with every position kept
+        self._moves: list[QPointF] = []
+        self._move_buttons = Qt.NoButton
+        self._last_flush = 0.0
+        self.move_timer = QTimer(self, singleShot=True, timerType=Qt.PreciseTimer)
+        self.move_timer.timeout.connect(self.flush_moves)
+
+        self._pending_ops = []
 
-        self._eraser_changed = False
+        # an eraser drag cuts pieces it cut before; the step it leaves only
+        # holds the strokes it started from and what is left of them
+        self._erase_before = None  # board when the drag first hit a stroke
+        self._erase_origin = {}  # id(piece) -> stroke the drag cut it from
+        self._erase_touched = {}  # id(stroke) -> [stroke, board rect changed]
 
-        self.history = []
-        self.history_index = -1
-        self.add_history_snapshot()
+        self.layers = default_layers()  # bottom to top
+        self.active_layer = 0
 
-        self.popup_value = 0
+        self.stroke_index = GridIndex()
+        self._pens = {}  # stroke style -> QPen
 
-    # mouse events
+        self.live_layer: QImage | None = None
+        self._live_rect = QRect()
+        self._live_under = None
+
+        self.history = History()
+        self.journal = None
+
+        self.show_repaints = False
+        self._repaint_hue = 0
+
+    # mouse and tablet events
     def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            brush = self.controller.get_brush()
-            self.begin_stroke(event.pos(), brush)
+        self.pointer_press(event.localPos(), event.button(), event.modifiers())
+
+    def mouseMoveEvent(self, event):
+        self.pointer_move(event.localPos(), event.buttons())
 
-        elif event.button() == Qt.MiddleButton:
+    def mouseReleaseEvent(self, event):
+        self.pointer_release(event.button())
+
+    def tabletEvent(self, event):
+        # sub-pixel pen positions; accepted, so Qt does not synthesize the
+        # matching mouse event
+        kind = event.type()
+        if kind == QEvent.TabletPress:
+            self.pointer_press(event.posF(), event.button(), event.modifiers())
+        elif kind == QEvent.TabletMove:
+            self.pointer_move(event.posF(), event.buttons())
+        elif kind == QEvent.TabletRelease:
+            self.pointer_release(event.button())
+        event.accept()
+
+    def pointer_press(self, pos: QPointF, button, modifiers):
+        self.flush_moves()
+
+        if button == Qt.LeftButton:
+            if modifiers & Qt.ControlModifier:
+                self._pan_from = pos.toPoint()
+                return
+
+            brush = self.view_brush(self.controller.get_brush())
+            if brush.tool in ("pen", "highlight") and not self.layer().editable:
+                return
+
+            self.begin_stroke(self.to_world(pos), brush)
+
+        elif button == Qt.MiddleButton:
             self.controller.quit()
 
-        elif event.button() == Qt.RightButton:
+        elif button == Qt.RightButton:
             self.controller.set_mode("view")
 
-    def mouseMoveEvent(self, event):
-        self.mouse_pos = event.pos()
-        self.update()
+    def pointer_move(self, pos: QPointF, buttons):
+        self._moves.append(pos)
+        self._move_buttons = buttons
 
-        if event.buttons() & Qt.LeftButton:
-            self.move_stroke(event.pos())
+        if not self.move_timer.isActive():
+            # QWidget.screen() is Qt 5.14+, the window handle has it on 5.x
+            handle = self.window().windowHandle()
+            rate = handle.screen().refreshRate() if handle else 0
+            frame_ms = 1000 / (rate or 60)
+            elapsed_ms = (time.perf_counter() - self._last_flush) * 1000
+            self.move_timer.start(max(0, int(frame_ms - elapsed_ms)))
 
-    def mouseReleaseEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.end_stroke()
+    def pointer_release(self, button):
+        self.flush_moves()
+
+        if button == Qt.LeftButton:
+            if self._pan_from is not None:
+                self._pan_from = None
+            else:
+                self.end_stroke()
+
+    def flush_moves(self):
+        self.move_timer.stop()
+        self._last_flush = time.perf_counter()
+
+        moves = self._moves
+        if not moves:
+            return
+        self._moves = []
+
+        self.mouse_pos = moves[-1].toPoint()
+        self.overlay.move_cursor(self.mouse_pos)
+
+        if self._pan_from is not None:
+            self.pan_view(self._pan_from - self.mouse_pos)
+            self._pan_from = self.mouse_pos
+
+        elif self._move_buttons & Qt.LeftButton:
+            self.move_stroke_to([self.to_world(pos) for pos in moves])
 
     def leaveEvent(self, event):
+        self.flush_moves()
         self.mouse_pos = None
-        self.update()
+        self.overlay.move_cursor(None)
 
     # stroke lifecycle
-    def begin_stroke(self, pos: QPoint, brush: BrushState):
+    def begin_stroke(self, pos: QPointF, brush: BrushState):
+        # free strokes keep sub-pixel points, line / rect corners are whole pixels
+        pos = QPointF(pos)
         self.current_brush = brush
-        self.start_pos = pos
-        self.last_pos = pos
+        self.start_pos = pos.toPoint()
+        self.last_pos = pos.toPoint()
         self.current_points = [pos]
 
+        if brush.shape == "free" and brush.tool != "eraser":
+            self.begin_live_layer()
+
         self.toolbar.hide()
         self.update()
 
-    def move_stroke(self, pos: QPoint):
+    def move_stroke_to(self, positions):
+        # every position of a frame goes into the stroke, one update for all
         b = self.current_brush
         if not b:
             return
 
         if b.tool == "eraser":
-            self.erase_at(pos)
+            for pos in positions:
+                self.erase_at(pos)
             return
 
         if b.shape == "free":
-            if not self.current_points:
-                self.current_points.append(pos)
-            else:
+            damage = QRect()
+            for pos in positions:
+                pos = QPointF(pos)
                 last = self.current_points[-1]
-                if (pos - last).manhattanLength() >= self.current_brush.size / 4:
+                if (pos - last).manhattanLength() >= b.size / 4:
                     self.current_points.append(pos)
-        else:
-            self.last_pos = pos
+                    self.draw_live_segment()
+                    damage |= self.points_rect(self.current_points[-4:], b.size)
 
-        self.update()
+            if not damage.isEmpty():
+                self.update_world(damage)
+        else:
+            old = self.preview_rect()
+            self.last_pos = QPointF(positions[-1]).toPoint()
+            self.update_world(old | self.preview_rect())
 
     def end_stroke(self):
         b = self.current_brush
         if not b:
             return
 
-        if b.tool == "eraser" and self._eraser_changed:
-            self.add_history_snapshot()
-            self._eraser_changed = False
-
         if b.tool == "crop_eraser":
             self.apply_crop_eraser()
-            if self._eraser_changed:
-                self.add_history_snapshot()
-                self._eraser_changed = False
-
-        elif b.tool != "eraser":
-            stroke = {
-                "shape": b.shape,
-                "color": b.color,
-                "size": b.size,
-                "round_cap": b.round_cap,
-            }
 
+        elif b.tool == "eraser":
+            self._pending_ops.extend(self.erase_ops())
+
+        else:
+            layer = self.active_layer
             if b.shape == "free":
-                stroke["points"] = self.current_points[:]
+                stroke = Stroke.free(
+                    b, self.current_points, self.simplify_tolerance, layer
+                )
 
             elif b.shape == "line":
-                stroke["start"] = self.start_pos
-                stroke["end"] = self.last_pos
+                stroke = Stroke.line(b, self.start_pos, self.last_pos, layer)
 
             elif b.shape == "rect":
-                stroke["rect"] = QRect(self.start_pos, self.last_pos).normalized()
+                stroke = Stroke.rect(b, self.start_pos, self.last_pos, layer)
 
-            self.strokes.append(stroke)
-            self.add_history_snapshot()
+            op = AddStroke(stroke)
+            self.apply_op(op)
+            self._pending_ops.append(op)
 
+        if self._pending_ops:
+            self.push_step(self._pending_ops)
+            self._pending_ops = []
+
+        damage = self.preview_rect()
         self.current_brush = None
         self.current_points = []
 
         self.toolbar.show()
-        self.update()
+        self.update_world(damage)
 
     # painting
     def paintEvent(self, event):
+        start = time.perf_counter_ns()
+
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
 
-        self.draw_background(painter)
+        dirty = event.rect()
+        self.draw_background(painter, dirty)
 
-        for s in self.strokes:
-            self.draw_stroke(painter, s)
+        self.draw_tiles(painter, dirty)
 
         if self.current_brush:
-            self.draw_preview(painter)
-
-        self.draw_ui_overlay(painter)
+            self.draw_preview(painter, dirty)
 
         if self.board_color != (0, 0, 0, 0):
             pen = QPen(QColor(255, 120, 0))
@@ -157,289 +268,717 @@ class Canva(QWidget):
             painter.setPen(pen)
             painter.drawRect(self.rect())
 
-    def draw_background(self, painter):
+        if self.show_repaints:
+            self.draw_repaint_regions(painter, event.region())
+
+        if self.profiler.enabled:
+            self.profiler.frame(time.perf_counter_ns() - start)
+
+    def draw_background(self, painter, rect):
         r, g, b, a = self.board_color
-        painter.fillRect(self.rect(), QColor(r, g, b, a))
+        painter.fillRect(rect, QColor(r, g, b, a))
 
-    def draw_stroke(self, painter, s):
-        pen = QPen(s["color"])
-        pen.setWidth(s["size"])
-        self.apply_cap_style(pen, bool(s.get("round_cap", False)))
+    def draw_repaint_regions(self, painter, region):
+        self._repaint_hue = (self._repaint_hue + 47) % 360
+
+        pen = QPen(QColor.fromHsv(self._repaint_hue, 255, 255))
+        pen.setWidth(1)
         painter.setPen(pen)
+        painter.setBrush(Qt.NoBrush)
+
+        for r in region.rects():
+            painter.drawRect(r.adjusted(0, 0, -1, -1))
+
+    # view transform
+    def to_world(self, pos):
+        return (QPointF(pos) + QPointF(self.view_pan)) / self.view_scale
+
+    def view_rect(self, rect):
+        # board rect to the screen pixels it covers
+        if rect.isEmpty():
+            return QRect()
+
+        s = self.view_scale
+        x0 = math.floor(rect.left() * s)
+        y0 = math.floor(rect.top() * s)
+        x1 = math.ceil((rect.right() + 1) * s)
+        y1 = math.ceil((rect.bottom() + 1) * s)
+        return QRect(x0, y0, x1 - x0, y1 - y0).translated(-self.view_pan)
+
+    def world_rect(self, rect):
+        # screen rect to the board rect under it
+        s = self.view_scale
+        x0 = math.floor((rect.left() + self.view_pan.x()) / s)
+        y0 = math.floor((rect.top() + self.view_pan.y()) / s)
+        x1 = math.ceil((rect.right() + 1 + self.view_pan.x()) / s)
+        y1 = math.ceil((rect.bottom() + 1 + self.view_pan.y()) / s)
+        return QRect(x0, y0, x1 - x0, y1 - y0)
+
+    def apply_view(self, painter):
+        painter.translate(-self.view_pan)
+        painter.scale(self.view_scale, self.view_scale)
+
+    def update_world(self, rect):
+        self.update(self.view_rect(rect))
+
+    def view_brush(self, brush):
+        # sizes are picked in screen pixels, strokes keep them in board pixels
+        if self.view_scale == 1:
+            return brush
+        return replace(brush, size=max(1, round(brush.size / self.view_scale)))
+
+    def pan_view(self, delta):
+        self.view_pan += delta
+        self.update()
+
+    def zoom_view(self, steps, pos):
+        if self.current_brush:
+            return
+
+        lo, hi = ZOOM_RANGE
+        level = round(math.log2(self.view_scale) * ZOOM_STEPS) + steps
+        scale = 2 ** (min(hi, max(lo, level)) / ZOOM_STEPS)
+
+        # keep the board point under pos in place
+        world = QPointF(pos + self.view_pan) / self.view_scale
+        self.view_scale = scale
+        self.view_pan = (world * scale).toPoint() - pos
+        self.update()
+
+    def reset_view(self):
+        self.view_scale = 1.0
+        self.view_pan = QPoint()
+        self.update()
+
+    # layers
+    def layer(self, lid=None):
+        lid = self.active_layer if lid is None else lid
+        for layer in self.layers:
+            if layer.id == lid:
+                return layer
+
+        # a stroke on a layer the loaded file did not describe
+        layer = Layer(lid, f"Layer {lid + 1}")
+        self.layers.append(layer)
+        return layer
+
+    def editable_layers(self):
+        return {layer.id for layer in self.layers if layer.editable}
+
+    def add_layer(self, name=None):
+        lid = max(layer.id for layer in self.layers) + 1
+        layer = Layer(lid, name or f"Layer {lid + 1}")
+        self.layers.append(layer)
+        self.active_layer = lid
+        self.layers_changed()
+        return layer
+
+    def set_active_layer(self, lid):
+        layer = self.layer(lid)
+        self.active_layer = layer.id
+
+        if not layer.visible:
+            self.set_layer_visible(lid, True)
+
+    # only the composite changes, the tiles of every layer are kept
+    def set_layer_visible(self, lid, visible):
+        self.layer(lid).visible = visible
+        self.layers_changed()
+        self.update()
+
+    def set_layer_opacity(self, lid, opacity):
+        self.layer(lid).opacity = opacity
+        self.layers_changed()
+        self.update()
+
+    def set_layer_locked(self, lid, locked):
+        self.layer(lid).locked = locked
+        self.layers_changed()
+
+    def layers_changed(self):
+        if self.journal:
+            self.journal.set_layers(tuple(layer.state() for layer in self.layers))
+
+    # stroke tiles
+    def invalidate_cache(self, rect=None):
+        for layer in self.layers:
+            layer.tiles.invalidate(rect)
+
+    def draw_tiles(self, painter, rect):
+        # only the tiles under the dirty screen rect are rendered or drawn
+        ratio = self.devicePixelRatioF()
+        pan = self.view_pan
+
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+
+            tiles = layer.tiles
+            tiles.set_view(self.view_scale, ratio)
+            painter.setOpacity(layer.opacity)
+
+            for key in tiles.keys_in(rect.translated(pan)):
+                image = self.render_tile(layer, key)
+                if image is None:
+                    continue
+
+                tile = tiles.tile_rect(key).translated(-pan)
+                self.blit(painter, image, rect & tile, tile.topLeft())
+
+        painter.setOpacity(1)
+
+    def render_tile(self, layer, key):
+        return layer.tiles.tile(key, self.strokes, self.draw_strokes)
+
+    def style_pen(self, style):
+        if style not in self._pens:
+            rgba, size, round_cap = style
+            pen = QPen(QColor.fromRgba(rgba))
+            pen.setWidth(size)
+            self.apply_cap_style(pen, round_cap)
+            self._pens[style] = pen
+        return self._pens[style]
+
+    def draw_strokes(self, painter, strokes):
+        # strokes in board order, one pen per run of a style. Each stroke is
+        # still its own draw call: merged paths or drawLines stroke a run as
+        # one shape, which changes the pixels where its strokes cross
+        # (benchmark.py render)
+        zoom = painter.worldTransform().m11() * painter.device().devicePixelRatioF()
+
+        for style, run in groupby(strokes, key=lambda s: s.style):
+            painter.setPen(self.style_pen(style))
+
+            for s in run:
+                if s.shape == "free":
+                    if len(s.xy) > 1:
+                        painter.drawPath(s.lod_path(zoom))
+
+                elif s.shape == "line":
+                    (x0, y0), (x1, y1) = s.xy.tolist()
+                    painter.drawLine(x0, y0, x1, y1)
+
+                elif s.shape == "rect":
+                    painter.drawRect(s.qrect())
+
+                elif s.shape == "poly":
+                    painter.drawPath(s.path())
+
+    # off-screen rendering for save
+    def strokes_rect(self):
+        visible = {layer.id for layer in self.layers if layer.visible}
 
-        if s["shape"] == "free":
-            self.draw_free_curve(painter, s["points"])
+        rect = QRect()
+        for s in self.strokes:
+            if s.layer in visible:
+                rect |= s.paint_rect()
+        return self.view_rect(rect)
+
+    def render_image(self, background, scale=1, crop=False, area=None):
+        # background is a QColor or a capture of the desktop under area
+        desktop = isinstance(background, QImage)
+
+        bounds = area or self.rect()
+        rect = bounds
+        if crop and self.strokes:
+            rect = self.strokes_rect()
+            if desktop or area:
+                rect &= bounds
 
-        elif s["shape"] == "line":
-            painter.drawLine(s["start"], s["end"])
+        image = QImage(rect.size() * scale, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent if desktop else background)
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.scale(scale, scale)
+        painter.translate(-rect.topLeft())
 
-        elif s["shape"] == "rect":
-            painter.drawRect(s["rect"])
+        if desktop:
+            painter.drawImage(QRectF(bounds), background)
 
-    def draw_preview(self, painter):
+        # the tiles already hold these pixels at their own ratio
+        if scale == self.devicePixelRatioF():
+            self.draw_tiles(painter, rect)
+        else:
+            bounds = rect_bounds(self.world_rect(rect))
+            for layer in self.layers:
+                if layer.visible:
+                    self.draw_layer(painter, layer, bounds)
+        painter.end()
+
+        return image
+
+    def draw_layer(self, painter, layer, bounds):
+        # a translucent layer is flattened first, like its tiles
+        target = painter
+        if layer.opacity < 1:
+            flat = QImage(painter.device().size(), QImage.Format_ARGB32_Premultiplied)
+            flat.fill(Qt.transparent)
+            target = QPainter(flat)
+            target.setRenderHint(QPainter.Antialiasing)
+            target.setTransform(painter.transform())
+
+        target.save()
+        self.apply_view(target)
+        self.draw_strokes(target, layer.tiles.query(bounds, self.strokes))
+        target.restore()
+
+        if target is not painter:
+            target.end()
+            painter.save()
+            painter.resetTransform()
+            painter.setOpacity(layer.opacity)
+            painter.drawImage(0, 0, flat)
+            painter.restore()
+
+    def blit(self, painter, image, dirty, origin=QPoint()):
+        ratio = image.devicePixelRatio()
+        source = QRectF(
+            (dirty.x() - origin.x()) * ratio,
+            (dirty.y() - origin.y()) * ratio,
+            dirty.width() * ratio,
+            dirty.height() * ratio,
+        )
+        painter.drawImage(QRectF(dirty), image, source)
+
+    def draw_preview(self, painter, dirty):
         b = self.current_brush
         if b.tool == "eraser":
             return
 
+        opacity = self.layer().opacity
+        if b.shape == "free":
+            if len(self.current_points) > 1:
+                painter.setOpacity(b.color.alphaF() * opacity)
+                self.blit(painter, self.live_layer, dirty)
+                painter.setOpacity(1)
+            return
+
         if b.tool == "crop_eraser":
             pen = QPen(QColor(200, 200, 200))
             pen.setWidth(1)
+            pen.setCosmetic(True)
             pen.setStyle(Qt.DashLine)
         else:
             pen = QPen(b.color)
             pen.setWidth(b.size)
             self.apply_cap_style(pen, b.round_cap)
 
+        painter.save()
+        self.apply_view(painter)
         painter.setPen(pen)
+        if b.tool != "crop_eraser":
+            painter.setOpacity(opacity)
 
-        if b.shape == "free" and len(self.current_points) > 1:
-            self.draw_free_curve(painter, self.current_points)
-
-        elif b.shape == "line":
+        if b.shape == "line":
             painter.drawLine(self.start_pos, self.last_pos)
 
         elif b.shape == "rect":
             rect = QRect(self.start_pos, self.last_pos).normalized()
             painter.drawRect(rect)
 
-    def draw_ui_overlay(self, p: QPainter):
-        if self.mouse_pos and self.controller.tool == "eraser":
-            pen = QPen(QColor(255, 120, 0))
-            pen.setWidth(2)
-            p.setPen(pen)
-            p.setBrush(Qt.NoBrush)
+        painter.restore()
 
-            r = self.controller.size / 2
-            p.drawEllipse(self.mouse_pos, r, r)
+    # damage tracking
+    def bounds_rect(self, bounds, size):
+        x0, y0, x1, y1 = bounds
+        pad = size // 2 + 2
+        return QRect(x0 - pad, y0 - pad, x1 - x0 + 2 * pad + 1, y1 - y0 + 2 * pad + 1)
 
-        if self.mouse_pos and self.popup_value:
-            pen = QPen(QColor(255, 200, 80))
-            pen.setWidth(2)
-            p.setPen(pen)
-
-            r = self.popup_value / 2
-            p.drawEllipse(self.mouse_pos, r, r)
+    def points_rect(self, pts, size):
+        return self.bounds_rect(self.points_bounds(pts), size)
 
-            font = QFont("Microsoft JhengHei")
-            font.setPixelSize(15)
-            font.setBold(True)
-            p.setFont(font)
+    def preview_rect(self):
+        b = self.current_brush
+        if not b or b.tool == "eraser":
+            return QRect()
 
-            p.drawText(self.mouse_pos + QPoint(21, -21), f"{self.popup_value}px")
+        if b.shape == "free":
+            if not self.current_points:
+                return QRect()
+            return self.points_rect(self.current_points, b.size)
 
-            self.popup_value = 0
+        return self.points_rect([self.start_pos, self.last_pos], b.size)
 
     # pen functions
     def apply_cap_style(self, pen: QPen, round_cap: bool):
         pen.setCapStyle(Qt.RoundCap if round_cap else Qt.FlatCap)
 
-    def draw_free_curve(self, painter, pts):
-        if len(pts) < 2:
-            return
+    # live stroke layer
+    def begin_live_layer(self):
+        ratio = self.devicePixelRatioF()
+        size = self.size() * ratio
+
+        if self.live_layer is None or self.live_layer.size() != size:
+            self.live_layer = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            self.live_layer.setDevicePixelRatio(ratio)
+            self.live_layer.fill(Qt.transparent)
+
+        elif not self._live_rect.isEmpty():
+            painter = QPainter(self.live_layer)
+            painter.setCompositionMode(QPainter.CompositionMode_Clear)
+            painter.fillRect(self._live_rect, Qt.transparent)
+            painter.end()
+
+        self._live_rect = QRect()
+        self._live_under = None
+
+    def live_pen(self, round_cap):
+        # drawn opaque, the layer is composited with the brush alpha
+        color = QColor(self.current_brush.color)
+        color.setAlpha(255)
+
+        pen = QPen(color)
+        pen.setWidth(self.current_brush.size)
+        self.apply_cap_style(pen, round_cap)
+        return pen
+
+    def draw_live_segment(self):
+        # same curve as free_curve_path: one quad per new point, plus a
+        # provisional straight tail that is undone when the next point comes
+        pts = self.current_points
+        b = self.current_brush
 
-        path = QPainterPath()
-        path.moveTo(pts[0])
+        painter = QPainter(self.live_layer)
+        painter.setRenderHint(QPainter.Antialiasing)
 
-        for i in range(1, len(pts) - 1):
-            mid = (pts[i] + pts[i + 1]) / 2
-            path.quadTo(pts[i], mid)
+        if self._live_under:
+            rect, under = self._live_under
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(rect, under)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
 
-        path.lineTo(pts[-1])
-        painter.drawPath(path)
+        self.apply_view(painter)
 
-    # eraser functions
-    def erase_at(self, pos):
-        before = len(self.strokes)
+        tail = pts[0]
+        if len(pts) > 2:
+            start = pts[0] if len(pts) == 3 else (pts[-3] + pts[-2]) / 2
+            tail = (pts[-2] + pts[-1]) / 2
 
-        r = self.current_brush.size / 2
-        self.strokes = [s for s in self.strokes if not self.stroke_hit(s, pos, r)]
+            path = QPainterPath()
+            path.moveTo(start)
+            path.quadTo(pts[-2], tail)
 
-        if len(self.strokes) != before:
-            self._eraser_changed = True
+            painter.setPen(self.live_pen(b.round_cap if len(pts) == 3 else True))
+            painter.drawPath(path)
 
-        self.update()
+        rect = self.view_rect(self.points_rect([tail, pts[-1]], b.size)) & self.rect()
+        ratio = self.live_layer.devicePixelRatio()
+        device = QRect(rect.topLeft() * ratio, rect.size() * ratio)
+        self._live_under = (QRectF(rect), self.live_layer.copy(device))
 
-    def stroke_hit(self, s, pos, r):
-        if s["shape"] == "free":
-            return any(
-                math.hypot(p.x() - pos.x(), p.y() - pos.y()) < r for p in s["points"]
-            )
-        elif s["shape"] == "line":
-            return self.line_hit(s["start"], s["end"], pos, r)
-        elif s["shape"] == "rect":
-            return self.rect_hit(s["rect"], pos, r)
-        else:
-            return False
+        painter.setPen(self.live_pen(b.round_cap))
+        painter.drawLine(tail, pts[-1])
+        painter.end()
 
-    def line_hit(self, a, b, p, r):
-        ax, ay = a.x(), a.y()
-        bx, by = b.x(), b.y()
-        px, py = p.x(), p.y()
+        self._live_rect |= self.view_rect(self.points_rect(pts[-3:], b.size))
 
-        abx, aby = bx - ax, by - ay
-        apx, apy = px - ax, py - ay
-        ab_len2 = abx * abx + aby * aby
+    # spatial index
+    def points_bounds(self, pts):
+        xs = [p.x() for p in pts]
+        ys = [p.y() for p in pts]
+        return min(xs), min(ys), max(xs), max(ys)
 
-        if ab_len2 == 0:
-            return math.hypot(px - ax, py - ay) <= r
+    def rebuild_index(self):
+        self.stroke_index.clear()
+        for layer in self.layers:
+            layer.tiles.clear()
 
-        t = max(0, min(1, (apx * abx + apy * aby) / ab_len2))
-        cx = ax + t * abx
-        cy = ay + t * aby
+        for s in self.strokes:
+            self.stroke_index.insert(s, s.bounds)
+            self.layer(s.layer).tiles.insert(s)
 
-        return math.hypot(px - cx, py - cy) <= r
+    def remove_strokes(self, removed):
+        ids = {id(s) for s in removed}
+        op = RemoveStrokes(
+            tuple((i, s) for i, s in enumerate(self.strokes) if id(s) in ids)
+        )
 
-    def rect_hit(self, rect, p, r):
-        tl = rect.topLeft()
-        tr = rect.topRight()
-        bl = rect.bottomLeft()
-        br = rect.bottomRight()
+        self.apply_op(op)
+        self._pending_ops.append(op)
 
-        return (
-            self.line_hit(tl, tr, p, r)
-            or self.line_hit(tr, br, p, r)
-            or self.line_hit(br, bl, p, r)
-            or self.line_hit(bl, tl, p, r)
+    # eraser functions
+    def erase_at(self, pos):
+        r = self.current_brush.size / 2
+        reach = math.ceil(r)
+        x, y = pos.x(), pos.y()
+
+        candidates = self.stroke_index.query(
+            (x - reach, y - reach, x + reach, y + reach)
+        )
+        editable = self.editable_layers()
+        splits = {}
+        for s in candidates:
+            if s.layer in editable:
+                split = self.split_stroke(s, x, y, r)
+                if split is not None:
+                    splits[id(s)] = split
+
+        if splits:
+            self.erase_strokes(splits)
+
+    def split_stroke(self, s, x, y, r):
+        # the pieces of s outside the eraser circle and the board rect whose
+        # pixels change; None when the eraser misses s
+        xy = s.xy
+        shape = s.shape
+        if shape == "rect":
+            # drawRect strokes QRectF(qrect()), one pixel past the corner
+            (x0, y0), (x1, y1) = xy.tolist()
+            xy = np.array([(x0, y0), (x1 + 1, y0), (x1 + 1, y1 + 1), (x0, y1 + 1)])
+            xy = np.concatenate([xy, xy[:1]])
+            shape = "poly"
+
+        clipped = clip_polyline_circle(xy, x, y, r)
+        if clipped is None:
+            return None
+        runs, changed = clipped
+
+        # a cut outline is one open polyline around its first corner
+        if (
+            s.shape == "rect"
+            and len(runs) > 1
+            and np.array_equal(runs[0][0], xy[0])
+            and np.array_equal(runs[-1][-1], xy[-1])
+        ):
+            runs = [np.concatenate([runs[-1], runs[0][1:]])] + runs[1:-1]
+
+        pieces = tuple(
+            Stroke(shape, s.rgba, s.size, s.round_cap, np.rint(run), layer=s.layer)
+            for run in runs
         )
 
+        # translucent pieces blend twice where they cross, anywhere on s
+        if QColor.fromRgba(s.rgba).alpha() < 255 and len(pieces) > 1:
+            return pieces, s.paint_rect()
+
+        dirty = QRect()
+        for lo, hi in changed:
+            dirty |= self.bounds_rect(array_bounds(xy[lo:hi]), s.size)
+        return pieces, dirty
+
+    def erase_strokes(self, splits):
+        # strokes the eraser took whole go in one op, cut strokes are replaced
+        # by their pieces from the top down so the lower indices still hold;
+        # the ops only update the board, erase_ops records the drag
+        if self._erase_before is None:
+            self._erase_before = list(self.strokes)
+
+        for s in self.strokes:
+            if id(s) in splits:
+                pieces, dirty = splits[id(s)]
+                origin = self._erase_origin.get(id(s), s)
+                touched = self._erase_touched.setdefault(id(origin), [origin, QRect()])
+                touched[1] |= dirty
+                for piece in pieces:
+                    self._erase_origin[id(piece)] = origin
+
+        whole = tuple(
+            (i, s)
+            for i, s in enumerate(self.strokes)
+            if id(s) in splits and not splits[id(s)][0]
+        )
+        if whole:
+            self.apply_op(RemoveStrokes(whole))
+
+        cut = [(i, s) for i, s in enumerate(self.strokes) if id(s) in splits]
+        for i, s in reversed(cut):
+            self.apply_op(SplitStroke(i, s, *splits[id(s)]))
+
+    def erase_ops(self):
+        # the drag as one op per stroke it started from: the strokes it took
+        # whole, then every cut stroke against the pieces left of it
+        before = self._erase_before
+        origin = self._erase_origin
+        touched = self._erase_touched
+        self._erase_before = None
+        self._erase_origin = {}
+        self._erase_touched = {}
+        if before is None:
+            return []
+
+        left = {}
+        for s in self.strokes:
+            if id(s) in origin:
+                left.setdefault(id(origin[id(s)]), []).append(s)
+
+        gone = {key for key in touched if key not in left}
+        removed = tuple((i, s) for i, s in enumerate(before) if id(s) in gone)
+        ops = [RemoveStrokes(removed)] if removed else []
+
+        kept = [s for s in before if id(s) not in gone]
+        cut = [(i, s) for i, s in enumerate(kept) if id(s) in left]
+        for i, s in reversed(cut):
+            ops.append(SplitStroke(i, s, tuple(left[id(s)]), touched[id(s)][1]))
+        return ops
+
     # crop_eraser functions
     def apply_crop_eraser(self):
-        before = len(self.strokes)
-
         crop_rect = QRect(self.start_pos, self.last_pos).normalized()
-        self.strokes = [
-            s for s in self.strokes if not self.stroke_intersect_rect(s, crop_rect)
+        bounds = (
+            crop_rect.left(),
+            crop_rect.top(),
+            crop_rect.right(),
+            crop_rect.bottom(),
+        )
+
+        candidates = self.stroke_index.query(bounds)
+        editable = self.editable_layers()
+        removed = [
+            s
+            for s in candidates
+            if s.layer in editable and self.stroke_intersect_rect(s, crop_rect)
         ]
 
-        if len(self.strokes) != before:
-            self._eraser_changed = True
+        if removed:
+            self.remove_strokes(removed)
 
     def stroke_intersect_rect(self, s, crop_rect: QRect):
-        if s["shape"] == "free":
-            return any(crop_rect.contains(p) for p in s["points"])
-        elif s["shape"] == "line":
-            line_rect = QRect(s["start"], s["end"]).normalized()
-            return line_rect.intersects(crop_rect)
-        elif s["shape"] == "rect":
-            return s["rect"].intersects(crop_rect)
+        bounds = (
+            crop_rect.left(),
+            crop_rect.top(),
+            crop_rect.right(),
+            crop_rect.bottom(),
+        )
+
+        if s.shape == "free":
+            return any_point_in_rect(s.xy, *bounds)
+        elif s.shape == "poly":
+            return any_segment_in_rect(s.xy, *bounds)
+        elif s.shape in ("line", "rect"):
+            return bounds_overlap(s.bounds, bounds)
         return False
 
     # history
-    def add_history_snapshot(self):
-        max_history = 50
-
-        self.history_index += 1
-        self.history = self.history[: self.history_index]
-        self.history.append(copy.deepcopy(self.strokes))
+    def apply_op(self, op, revert=False):
+        if revert:
+            added, removed = op.revert(self.strokes)
+        else:
+            added, removed = op.apply(self.strokes)
+
+        # a split stroke and its pieces only differ around the cuts (below 1/2x
+        # the pieces simplify on their own, within half a device pixel); a
+        # split read from a file does not know where, the whole stroke is redrawn
+        dirty = op.dirty if isinstance(op, SplitStroke) else None
+
+        damage = QRect()
+        for s in removed:
+            self.stroke_index.remove(s)
+            self.layer(s.layer).tiles.remove(s, dirty)
+            damage |= s.paint_rect() if dirty is None else dirty
+            s.drop_cache()
+
+        # strokes appended on top are drawn into the built tiles, strokes put
+        # back below others (undoing an erase) rebuild the tiles they touch;
+        # either way only the tiles of the stroke's own layer change
+        on_top = self.strokes[len(self.strokes) - len(added) :] == added
+        for s in added:
+            tiles = self.layer(s.layer).tiles
+            self.stroke_index.insert(s, s.bounds)
+            tiles.insert(s)
+
+            if dirty is not None:
+                tiles.invalidate(dirty)
+            elif on_top:
+                damage |= s.paint_rect()
+                tiles.bake(s, self.draw_strokes)
+            else:
+                rect = s.paint_rect()
+                damage |= rect
+                tiles.invalidate(rect)
 
-        if len(self.history) > max_history:
-            self.history.pop(0)
-            self.history_index -= 1
+        self.update_world(damage)
 
-    def restore(self, snap):
-        self.strokes = copy.deepcopy(snap)
+    def reset_stroke(self):
         self.current_brush = None
         self.start_pos = None
         self.last_pos = None
         self.current_points = []
+        self._pending_ops = []
+        self._erase_before = None
+        self._erase_origin = {}
+        self._erase_touched = {}
 
         self.toolbar.show()
-        self.update()
 
-    def undo(self):
-        if self.history_index > 0:
-            self.history_index -= 1
-            self.restore(self.history[self.history_index])
+    def push_step(self, ops):
+        self.history.push(ops)
+        if self.journal:
+            self.journal.push(ops)
 
-    def redo(self):
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.restore(self.history[self.history_index])
+    def undo(self):
+        # a stroke in progress has changed the board already, it becomes
+        # its own step first
+        self.end_stroke()
 
-    def clear(self):
-        if not self.strokes:
+        step = self.history.undo()
+        if step is None:
             return
 
-        self.strokes.clear()
-        self.add_history_snapshot()
-        self.update()
-
-    # things to json
-    def point_to_json(self, p):
-        return [p.x(), p.y()]
-
-    def rect_to_json(self, r):
-        return [r.x(), r.y(), r.width(), r.height()]
+        if self.journal:
+            self.journal.undo()
 
-    def color_to_json(self, c):
-        return [c.red(), c.green(), c.blue(), c.alpha()]
+        for op in reversed(step):
+            self.apply_op(op, revert=True)
+        self.reset_stroke()
 
-    def stroke_to_json(self, s):
-        data = {
-            "shape": s["shape"],
-            "color": self.color_to_json(s["color"]),
-            "size": s["size"],
-            "round_cap": s.get("round_cap", False),
-        }
-
-        if s["shape"] == "free":
-            data["points"] = [self.point_to_json(p) for p in s["points"]]
+    def redo(self):
+        self.end_stroke()
 
-        elif s["shape"] == "line":
-            data["start"] = self.point_to_json(s["start"])
-            data["end"] = self.point_to_json(s["end"])
+        step = self.history.redo()
+        if step is None:
+            return
 
-        elif s["shape"] == "rect":
-            data["rect"] = self.rect_to_json(s["rect"])
+        if self.journal:
+            self.journal.redo()
 
-        return data
+        for op in step:
+            self.apply_op(op)
+        self.reset_stroke()
 
-    # json to things
-    def json_to_point(self, data):
-        return QPoint(data[0], data[1])
+    def clear(self):
+        # strokes on hidden or locked layers are kept
+        self.end_stroke()
 
-    def json_to_rect(self, data):
-        return QRect(data[0], data[1], data[2], data[3])
+        editable = self.editable_layers()
+        removed = tuple(
+            (i, s) for i, s in enumerate(self.strokes) if s.layer in editable
+        )
+        if not removed:
+            return
 
-    def json_to_color(self, data):
-        return QColor(data[0], data[1], data[2], data[3])
+        if len(removed) == len(self.strokes):
+            op = ClearStrokes(tuple(self.strokes))
+        else:
+            op = RemoveStrokes(removed)
 
-    def json_to_stroke(self, data):
-        stroke = {
-            "shape": data["shape"],
-            "color": self.json_to_color(data["color"]),
-            "size": data["size"],
-            "round_cap": data.get("round_cap", False),
-        }
+        self.apply_op(op)
+        self.push_step([op])
 
-        if data["shape"] == "free":
-            stroke["points"] = [self.json_to_point(p) for p in data["points"]]
+    # export and import
+    def snapshot(self):
+        # strokes and history ops are immutable, safe to hand to a worker thread
+        layers = tuple(layer.state() for layer in self.layers)
+        return self.board_color, self.history.copy(), tuple(self.strokes), layers
 
-        elif data["shape"] == "line":
-            stroke["start"] = self.json_to_point(data["start"])
-            stroke["end"] = self.json_to_point(data["end"])
+    def load_session(self, header, base, steps):
+        self.board_color = tuple(header.get("board_color", (0, 0, 0, 50)))
 
-        elif data["shape"] == "rect":
-            stroke["rect"] = self.json_to_rect(data["rect"])
+        states = header.get("layers")
+        if states:
+            self.layers = [Layer.from_state(state) for state in states]
+        else:
+            self.layers = default_layers()
 
-        return stroke
+        index = header.get("history_index", len(steps))
+        self.strokes = self.history.load_steps(base, steps, index)
 
-    # export and import
-    def export_json_data(self):
-        return {
-            "app": "Desktop-screen-pen",
-            "board_color": list(self.board_color),
-            "history": [
-                [self.stroke_to_json(s) for s in snap] for snap in self.history
-            ],
-            "history_index": self.history_index,
-        }
-
-    def import_json_data(self, data):
-        self.board_color = tuple(data.get("board_color", (0, 0, 0, 50)))
-        self.history = [
-            [self.json_to_stroke(s) for s in snap] for snap in data.get("history", [[]])
-        ]
-        self.history_index = data.get("history_index", len(self.history) - 1)
+        self.rebuild_index()
+        self.active_layer = self.layers[-1].id
+        self.reset_stroke()
+        self.update()
 
-        self.restore(self.history[self.history_index])
+        # the journal restarts from the loaded board
+        if self.journal:
+            self.journal.compact()
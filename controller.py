@@ -2,14 +2,20 @@
 # type: ignore
 
 from PySide2.QtWidgets import QApplication, QFileDialog
-from PySide2.QtGui import QColor
-from PySide2.QtCore import Qt
+from PySide2.QtGui import QColor, QDesktopServices, QImage, QPainter
+from PySide2.QtCore import Qt, QEventLoop, QLockFile, QThreadPool, QTimer, QUrl
+from PySide2.QtCore import QRect, QRectF
+from PySide2.QtCore import QBuffer, QByteArray, QIODevice
 from dataclasses import dataclass
-from mss.tools import to_png
-from mss import mss
-import json
 import os
 
+from archive import is_archive, write_archive, read_archive
+from journal import Journal, read_journal
+from session import replacing, save_session, load_session
+from worker import Task
+
+CAPTURE_WAIT_MS = 50  # a few frames for the compositor to hide the board
+
 
 @dataclass
 class BrushState:
@@ -72,6 +78,22 @@ tool_states = {
 }
 
 
+def write_png(image, path, progress=None):
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+
+    if not image.save(buffer, "PNG"):
+        raise OSError(f"Could not encode {path}")
+
+    # encoding is most of the work; a cancel here leaves the old file alone
+    if progress:
+        progress(1, 2)
+
+    with replacing(path, "wb") as f:
+        f.write(bytes(data))
+
+
 class Controller:
     def __init__(self, window, canva):
         self.window = window
@@ -79,6 +101,15 @@ class Controller:
 
         self.tool = "pen"
 
+        self.pool = QThreadPool.globalInstance()
+        self.journal = None
+        self.journal_lock = None
+        self.task: Task | None = None
+        self.resident = False  # quitting hides the board, see daemon.py
+        # (screen geometry, capture) per monitor from before the board showed,
+        # None once view mode has let the desktop change under it
+        self.desktop = None
+
     def get_brush(self):
         return tool_states[self.tool]
 
@@ -108,9 +139,14 @@ class Controller:
         else:
             tool_states[self.tool].size = max(2, self.size - change)
 
-        self.canva.popup_value = self.size
         self.toolbar.update_icons()
-        self.canva.update()
+        self.overlay.show_popup(self.size)
+
+    def zoom(self, delta, pos):
+        self.canva.zoom_view(1 if delta > 0 else -1, pos)
+
+    def reset_view(self):
+        self.canva.reset_view()
 
     # mode toggles
     def toggle_drawing_mode(self, reverse=False):
@@ -183,14 +219,40 @@ class Controller:
         else:
             self.set_tool("highlight")
 
+    def toggle_layer(self, reverse=False):
+        ids = [layer.id for layer in self.canva.layers]
+
+        i = ids.index(self.canva.active_layer)
+        i = i - 1 if reverse else i + 1
+        i %= len(ids)
+
+        self.set_layer(ids[i])
+
+    def toggle_repaint_regions(self):
+        self.canva.show_repaints = not self.canva.show_repaints
+        self.canva.update()
+
+    def toggle_hud(self):
+        show = not self.overlay.show_hud
+
+        if show:
+            self.profiler.start()
+        else:
+            self.profiler.stop()
+
+        self.overlay.set_hud(show)
+
     # direct brush settings
     def set_mode(self, mode: str):
+        old = self.canva.board_color
         if mode == "view":
             self.canva.board_color = (0, 0, 0, 0)
+            self.desktop = None
         elif mode == "drawing" and self.canva.board_color == (0, 0, 0, 0):
             self.canva.board_color = (0, 0, 0, 50)
 
-        self.canva.update()
+        if self.canva.board_color != old:
+            self.canva.update()
 
     def set_pen(self, size=4, shape="free", color="white"):
         self.set_tool("pen")
@@ -206,7 +268,7 @@ class Controller:
 
         self.tool = tool
         self.toolbar.update_icons()
-        self.canva.update()
+        self.overlay.update_cursor()
         self.canva.setCursor(tool_states[self.tool].cursor)
 
         self.set_mode("drawing")
@@ -217,6 +279,7 @@ class Controller:
 
         tool_states[self.tool].size = size
         self.toolbar.update_icons()
+        self.overlay.update_cursor()
 
         self.set_mode("drawing")
 
@@ -259,62 +322,270 @@ class Controller:
 
         self.set_mode("drawing")
 
+    # layers
+    def set_layer(self, lid):
+        self.canva.set_active_layer(lid)
+        self.toolbar.update_icons()
+
+    def add_layer(self):
+        self.canva.add_layer()
+        self.toolbar.update_icons()
+
+    def toggle_layer_visible(self, lid):
+        self.canva.set_layer_visible(lid, not self.canva.layer(lid).visible)
+        self.toolbar.update_icons()
+
+    def toggle_layer_locked(self, lid):
+        self.canva.set_layer_locked(lid, not self.canva.layer(lid).locked)
+        self.toolbar.update_icons()
+
+    def set_layer_opacity(self, lid, opacity):
+        self.canva.set_layer_opacity(lid, opacity)
+
+    # background tasks
+    def start_task(self, label, func, *args, done=None):
+        if self.task:
+            return
+
+        task = Task(func, *args)
+        task.signals.progress.connect(
+            lambda percent: self.overlay.show_task(
+                f"{label} {percent}%   Esc to cancel"
+            )
+        )
+        task.signals.finished.connect(lambda result: self.finish_task(done, result))
+        task.signals.failed.connect(
+            lambda error: self.finish_task(message=f"{label} failed: {error}")
+        )
+        task.signals.cancelled.connect(
+            lambda: self.finish_task(message=f"{label} cancelled")
+        )
+
+        self.task = task
+        self.overlay.show_task(f"{label}...")
+        self.pool.start(task)
+        return task
+
+    def finish_task(self, done=None, result=None, message=""):
+        self.task = None
+        self.show_message(message)
+        if done:
+            done(result)
+
+    def show_message(self, message):
+        self.overlay.show_task(message)
+        if message:
+            QTimer.singleShot(3000, lambda: self.clear_task_message(message))
+
+    def clear_task_message(self, message):
+        if self.overlay.task_text == message:
+            self.overlay.show_task("")
+
+    def cancel_task(self):
+        if not self.task:
+            return False
+
+        self.task.cancel()
+        return True
+
+    def wait_task(self):
+        self.pool.waitForDone()
+        QApplication.processEvents()
+
     # direct actions
-    def save(self, back=None):
-        old = self.canva.board_color
-        if back == "black":
-            self.canva.board_color = (0, 0, 0, 255)
+    def save(self, back=None, scale=1, crop=False, path=None, screen=None):
+        if self.task:
+            return
+
+        # the whole overlay, or one monitor of it
+        area = self.canva.rect()
+        if screen is not None:
+            g = QApplication.screens()[screen].geometry()
+            area = QRect(self.canva.mapFromGlobal(g.topLeft()), g.size())
+            area &= self.canva.rect()
+
+        if back == "black" or (back is None and self.canva.board_color[3] == 255):
+            background = QColor(0, 0, 0)
         elif back == "trans":
-            self.canva.board_color = (0, 0, 0, 0)
-        elif self.canva.board_color == (0, 0, 0, 50):
-            self.canva.board_color = (0, 0, 0, 0)
+            background = QColor(Qt.transparent)
+        else:
+            background = self.grab_desktop(area)
 
-        self.toolbar.hide()
-        self.canva.update()
-        QApplication.processEvents()
+        image = self.canva.render_image(background, scale, crop, area)
+
+        if path:
+            self.start_task("Saving", write_png, image, path)
+            return
 
         download = os.path.join(os.path.expanduser("~"), "Downloads")
         default_path = os.path.join(download, "screenshot.png")
-        with mss() as sct:
-            screenshot = sct.grab(sct.monitors[1])
-            to_png(screenshot.rgb, screenshot.size, output=default_path)
-        os.startfile(download)
+        self.start_task(
+            "Saving",
+            write_png,
+            image,
+            default_path,
+            done=lambda _: QDesktopServices.openUrl(QUrl.fromLocalFile(download)),
+        )
 
-        self.canva.board_color = old
-        self.toolbar.show()
-        self.canva.update()
+    def capture_desktop(self):
+        # every monitor while the board is hidden, so saving over the desktop
+        # does not have to hide the board while it covers the desktop
+        self.desktop = [
+            (screen.geometry(), screen.grabWindow(0))
+            for screen in QApplication.screens()
+        ]
+
+    def capture_behind(self):
+        # the board is see-through for a few frames so the compositor has
+        # taken it off the screens before the grab
+        self.window.setWindowOpacity(0)
+        loop = QEventLoop()
+        QTimer.singleShot(CAPTURE_WAIT_MS, loop.quit)
+        loop.exec_()
+
+        self.capture_desktop()
+        self.window.setWindowOpacity(1)
+
+    def grab_desktop(self, area):
+        # the part of the desktop capture under the overlay area, strokes are
+        # drawn on top of it off-screen
+        ratio = self.canva.devicePixelRatioF()
+        image = QImage(area.size() * ratio, QImage.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(ratio)
+        image.fill(Qt.transparent)
+
+        target = QRect(self.canva.mapToGlobal(area.topLeft()), area.size())
+        if self.desktop is None:
+            self.capture_behind()
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        for g, capture in self.desktop:
+            part = target & g
+            if part.isEmpty() or capture.isNull():
+                continue
+
+            # captures are in device pixels, relative to their screen
+            s = capture.width() / g.width()
+            source = part.translated(-g.topLeft())
+            painter.drawPixmap(
+                QRectF(part.translated(-target.topLeft())),
+                capture,
+                QRectF(
+                    source.x() * s,
+                    source.y() * s,
+                    source.width() * s,
+                    source.height() * s,
+                ),
+            )
+        painter.end()
+
+        return image
 
     def export_json(self):
         download = os.path.join(os.path.expanduser("~"), "Downloads")
         default_path = os.path.join(download, "drawing.json")
 
-        path, _ = QFileDialog.getSaveFileName(
-            self.window, "Save Drawing JSON", default_path, "JSON Files (*.json)"
+        path, selected = QFileDialog.getSaveFileName(
+            self.window,
+            "Save Drawing JSON",
+            default_path,
+            "JSON Files (*.json);;Drawing Archive (*.spen)",
         )
 
         if not path:
             return
 
+        if "*.spen" in selected or path.lower().endswith(".spen"):
+            if not path.lower().endswith(".spen"):
+                path += ".spen"
+            self.write_archive(path)
+            return
+
         if not path.lower().endswith(".json"):
             path += ".json"
 
-        data = self.canva.export_json_data()
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        self.write_json(path)
+
+    def write_json(self, path):
+        self.start_task("Exporting", save_session, path, *self.canva.snapshot())
+
+    def write_archive(self, path):
+        self.start_task("Exporting", write_archive, path, *self.canva.snapshot())
 
     def import_json(self):
         download = os.path.join(os.path.expanduser("~"), "Downloads")
 
         path, _ = QFileDialog.getOpenFileName(
-            self.window, "Open Drawing JSON", download, "JSON Files (*.json)"
+            self.window,
+            "Open Drawing JSON",
+            download,
+            "Drawings (*.json *.spen)",
         )
 
         if not path:
             return
 
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        self.canva.import_json_data(data)
+        if is_archive(path):
+            self.read_archive(path)
+        else:
+            self.read_json(path)
+
+    def read_json(self, path):
+        self.start_task("Importing", load_session, path, done=self.load_session)
+
+    def read_archive(self, path):
+        self.start_task("Importing", read_archive, path, done=self.load_session)
+
+    def load_session(self, result):
+        self.canva.load_session(*result)
+        self.toolbar.update_icons()
+
+    # autosave journal
+    def open_journal(self, path, restore=True):
+        # another instance on the same journal would overwrite it with its board
+        lock = QLockFile(path + ".lock")
+        lock.setStaleLockTime(0)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not lock.tryLock():
+            self.show_message("Journal in use by another instance, not autosaving")
+            return
+
+        self.journal_lock = lock
+        self.journal = Journal(path, self.canva.snapshot)
+        self.journal.on_error = lambda error: self.show_message(
+            f"Autosave stopped: {error}"
+        )
+
+        if not (restore and os.path.exists(path) and os.path.getsize(path)):
+            self.start_journal()
+            return
+
+        task = self.start_task(
+            "Restoring", read_journal, path, done=self.restore_journal
+        )
+        # an unreadable journal is kept aside instead of being overwritten
+        task.signals.failed.connect(lambda _: self.start_journal(keep_old=True))
+        task.signals.cancelled.connect(lambda: self.start_journal(keep_old=True))
+
+    def restore_journal(self, result):
+        self.load_session(result)
+        self.start_journal()
+
+    def start_journal(self, keep_old=False):
+        path = self.journal.path
+        if keep_old and os.path.exists(path):
+            os.replace(path, path + ".bak")
+
+        self.canva.journal = self.journal
+        self.journal.start()
+
+    def close_journal(self):
+        if self.journal:
+            self.journal.close()
+        if self.journal_lock:
+            self.journal_lock.unlock()
+            self.journal_lock = None
 
     def undo(self):
         self.canva.undo()
@@ -325,5 +596,32 @@ class Controller:
     def clear(self):
         self.canva.clear()
 
+    def cancel_or_quit(self):
+        if not self.cancel_task():
+            self.quit()
+
     def quit(self):
+        if self.resident:
+            self.hide_overlay()
+        else:
+            self.window.close()
+
+    # resident mode
+    def show_overlay(self):
+        self.window.present()
+
+    def hide_overlay(self):
+        # a stroke or pan in progress ends where it is
+        self.canva.pointer_release(Qt.LeftButton)
+        self.overlay.move_cursor(None)
+        self.window.hide()
+
+    def toggle_overlay(self):
+        if self.window.isVisible():
+            self.hide_overlay()
+        else:
+            self.show_overlay()
+
+    def shutdown(self):
+        self.resident = False
         self.window.close()
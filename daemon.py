@@ -0,0 +1,123 @@
+# daemon.py
+# type: ignore
+
+# resident mode: the board stays loaded and hidden, a local socket shows or
+# hides it. One command per connection, a line each way:
+#   show / hide / toggle  -> "visible" or "hidden"
+#   ping                  -> "visible" or "hidden", nothing changes
+#   quit                  -> "bye", the daemon exits
+# the client is plain sockets where it can be; importing Qt would take most
+# of a hotkey's time, so QtNetwork is only imported where it is needed
+
+import getpass
+import os
+import socket
+
+TIMEOUT_MS = 1000
+
+
+def default_server_name():
+    return os.environ.get("SCREEN_PEN_SOCKET") or f"screen-pen-{getpass.getuser()}"
+
+
+def server_path(name):
+    # where QLocalServer puts a plain name on Unix; a named pipe on Windows
+    if not hasattr(socket, "AF_UNIX"):
+        return name
+    return os.path.join(os.environ.get("TMPDIR") or "/tmp", name)
+
+
+def send_command(command, name=None, timeout=TIMEOUT_MS):
+    # the daemon's reply, None when no daemon is listening
+    path = server_path(name or default_server_name())
+    if not hasattr(socket, "AF_UNIX"):
+        return send_qt_command(command, path, timeout)
+
+    reply = b""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout / 1000)
+        try:
+            s.connect(path)
+            s.sendall(f"{command}\n".encode())
+            while not reply.endswith(b"\n"):
+                chunk = s.recv(256)
+                if not chunk:
+                    break
+                reply += chunk
+        except OSError:
+            return None
+
+    return reply.decode().strip() or None
+
+
+def send_qt_command(command, path, timeout):
+    from PySide2.QtNetwork import QLocalSocket
+
+    s = QLocalSocket()
+    s.connectToServer(path)
+    if not s.waitForConnected(timeout):
+        return None
+
+    s.write(f"{command}\n".encode())
+    s.waitForBytesWritten(timeout)
+
+    reply = b""
+    while not reply.endswith(b"\n") and s.waitForReadyRead(timeout):
+        reply += bytes(s.readAll())
+
+    s.disconnectFromServer()
+    return reply.decode().strip() or None
+
+
+class ControlServer:
+    def __init__(self, controller, name=None):
+        from PySide2.QtNetwork import QLocalServer
+
+        self.controller = controller
+        self.path = server_path(name or default_server_name())
+
+        self.server = QLocalServer()
+        self.server.newConnection.connect(self.accept)
+
+    def listen(self):
+        # False when another daemon already answers on the name
+        if send_command("ping", self.path) is not None:
+            return False
+
+        # a socket file left behind by a crash
+        self.server.removeServer(self.path)
+        return self.server.listen(self.path)
+
+    def close(self):
+        self.server.close()
+
+    def accept(self):
+        while self.server.hasPendingConnections():
+            conn = self.server.nextPendingConnection()
+            conn.readyRead.connect(lambda conn=conn: self.read(conn))
+            conn.disconnected.connect(conn.deleteLater)
+
+    def read(self, conn):
+        if not conn.canReadLine():
+            return
+
+        command = bytes(conn.readLine()).decode().strip()
+        conn.write(f"{self.handle(command)}\n".encode())
+        conn.flush()
+        conn.disconnectFromServer()
+
+    def handle(self, command):
+        c = self.controller
+        if command == "show":
+            c.show_overlay()
+        elif command == "hide":
+            c.hide_overlay()
+        elif command == "toggle":
+            c.toggle_overlay()
+        elif command == "quit":
+            c.shutdown()
+            return "bye"
+        elif command != "ping":
+            return f"error: unknown command {command!r}"
+
+        return "visible" if c.window.isVisible() else "hidden"
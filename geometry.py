@@ -0,0 +1,133 @@
+# geometry.py
+# type: ignore
+
+import numpy as np
+
+
+def array_bounds(xy):
+    x0, y0 = xy.min(axis=0)
+    x1, y1 = xy.max(axis=0)
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def any_point_in_rect(xy, left, top, right, bottom):
+    xs = xy[:, 0]
+    ys = xy[:, 1]
+    inside = (xs >= left) & (xs <= right) & (ys >= top) & (ys <= bottom)
+    return bool(inside.any())
+
+
+def any_segment_in_rect(xy, left, top, right, bottom):
+    # segment bounds against the rect, exact for the axis-aligned sides of
+    # a cut rectangle
+    if len(xy) == 1:
+        return any_point_in_rect(xy, left, top, right, bottom)
+
+    a = xy[:-1]
+    b = xy[1:]
+    x0 = np.minimum(a[:, 0], b[:, 0])
+    x1 = np.maximum(a[:, 0], b[:, 0])
+    y0 = np.minimum(a[:, 1], b[:, 1])
+    y1 = np.maximum(a[:, 1], b[:, 1])
+    hit = (x0 <= right) & (x1 >= left) & (y0 <= bottom) & (y1 >= top)
+    return bool(hit.any())
+
+
+def segment_distances(f, a, b):
+    ab = b - a
+    ap = f - a
+
+    len2 = float(ab @ ab)
+    if len2 == 0:
+        t = np.zeros(len(f))
+    else:
+        t = np.clip((ap @ ab) / len2, 0, 1)
+
+    d = ap - t[:, None] * ab
+    return np.sqrt(np.einsum("ij,ij->i", d, d))
+
+
+def simplify_polyline(xy, tolerance):
+    # Ramer-Douglas-Peucker against the segment between the kept ends
+    if tolerance <= 0 or len(xy) < 3:
+        return xy
+
+    f = xy.astype(np.float64)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+
+        d = segment_distances(f[i + 1 : j], f[i], f[j])
+        k = int(d.argmax())
+        if d[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+
+    return xy[keep]
+
+
+def clip_polyline_circle(xy, x, y, r):
+    # the runs of a polyline outside the circle, cut where it crosses it,
+    # and the index ranges of the points whose curve changes at the cuts;
+    # None when the circle does not touch the polyline
+    f = xy.astype(np.float64)
+    if len(f) == 1:
+        dx, dy = f[0, 0] - x, f[0, 1] - y
+        return ([], [(0, 1)]) if dx * dx + dy * dy < r * r else None
+
+    a = f[:-1]
+    d = f[1:] - a
+    m = a - (x, y)
+
+    # |m + t d| < r for t0 < t < t1
+    qa = np.einsum("ij,ij->i", d, d)
+    qb = np.einsum("ij,ij->i", m, d)
+    qc = np.einsum("ij,ij->i", m, m) - r * r
+    disc = qb * qb - qa * qc
+
+    ok = (disc > 0) & (qa > 0)
+    root = np.sqrt(np.where(ok, disc, 0))
+    safe = np.where(ok, qa, 1)
+    t0 = np.where(ok, (-qb - root) / safe, 2)
+    t1 = np.where(ok, (-qb + root) / safe, 2)
+
+    # a zero length segment is inside or not at all
+    still = qa == 0
+    t0[still] = np.where(qc[still] < 0, 0, 2)
+    t1[still] = 1
+
+    hit = (t0 < 1) & (t1 > 0)
+    if not hit.any():
+        return None
+
+    pieces = []
+    changed = []
+    start = 0  # first original point of the current run
+    lead = []  # the cut it starts with
+    n = len(f)
+    for i in np.flatnonzero(hit).tolist():
+        s0 = max(0.0, float(t0[i]))
+        s1 = min(1.0, float(t1[i]))
+
+        run = lead + list(f[start : i + 1] if s0 > 0 else f[start:i])
+        if s0 > 0:
+            run.append(a[i] + s0 * d[i])
+        if len(run) > 1:
+            pieces.append(np.array(run))
+
+        lead = [a[i] + s1 * d[i]] if s1 < 1 else []
+        start = i + 1
+        changed.append((max(0, i - 1), min(n, i + 3)))
+
+    run = lead + list(f[start:])
+    if len(run) > 1:
+        pieces.append(np.array(run))
+
+    return pieces, changed
@@ -0,0 +1,182 @@
+# history.py
+# type: ignore
+
+from dataclasses import dataclass, field
+
+from stroke import Stroke
+
+
+@dataclass(frozen=True)
+class AddStroke:
+    stroke: Stroke
+    nbytes: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "nbytes", self.stroke.nbytes)
+
+    def apply(self, strokes):
+        strokes.append(self.stroke)
+        return [self.stroke], []
+
+    def revert(self, strokes):
+        strokes.pop()
+        return [], [self.stroke]
+
+
+@dataclass(frozen=True)
+class RemoveStrokes:
+    removed: tuple  # ((index, stroke), ...) in ascending index order
+    nbytes: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        size = sum(s.nbytes for _, s in self.removed)
+        object.__setattr__(self, "nbytes", size)
+
+    def apply(self, strokes):
+        for i, _ in reversed(self.removed):
+            del strokes[i]
+        return [], [s for _, s in self.removed]
+
+    def revert(self, strokes):
+        for i, s in self.removed:
+            strokes.insert(i, s)
+        return [s for _, s in self.removed], []
+
+
+@dataclass(frozen=True)
+class SplitStroke:
+    index: int
+    stroke: Stroke
+    pieces: tuple  # what the eraser left of stroke, in its place
+    dirty: object = field(default=None, compare=False)  # board QRect that changes
+    nbytes: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        size = self.stroke.nbytes + sum(s.nbytes for s in self.pieces)
+        object.__setattr__(self, "nbytes", size)
+
+    def apply(self, strokes):
+        strokes[self.index : self.index + 1] = self.pieces
+        return list(self.pieces), [self.stroke]
+
+    def revert(self, strokes):
+        strokes[self.index : self.index + len(self.pieces)] = [self.stroke]
+        return [self.stroke], list(self.pieces)
+
+
+@dataclass(frozen=True)
+class ClearStrokes:
+    strokes: tuple
+    nbytes: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        size = sum(s.nbytes for s in self.strokes)
+        object.__setattr__(self, "nbytes", size)
+
+    def apply(self, strokes):
+        strokes.clear()
+        return [], list(self.strokes)
+
+    def revert(self, strokes):
+        strokes.extend(self.strokes)
+        return list(self.strokes), []
+
+
+def step_nbytes(step):
+    return sum(op.nbytes for op in step)
+
+
+class History:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        self.steps: list[tuple] = []
+        self.index = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.steps)
+
+    def copy(self):
+        # steps are tuples of frozen ops, a shallow copy is a safe snapshot
+        other = History(self.max_bytes)
+        other.steps = list(self.steps)
+        other.index = self.index
+        other.nbytes = self.nbytes
+        return other
+
+    def clear(self):
+        self.steps = []
+        self.index = 0
+        self.nbytes = 0
+
+    def push(self, ops):
+        for step in self.steps[self.index :]:
+            self.nbytes -= step_nbytes(step)
+        del self.steps[self.index :]
+
+        step = tuple(ops)
+        self.steps.append(step)
+        self.index += 1
+        self.nbytes += step_nbytes(step)
+
+        while self.nbytes > self.max_bytes and self.index > 1:
+            self.nbytes -= step_nbytes(self.steps.pop(0))
+            self.index -= 1
+
+    def undo(self):
+        if self.index == 0:
+            return None
+
+        self.index -= 1
+        return self.steps[self.index]
+
+    def redo(self):
+        if self.index == len(self.steps):
+            return None
+
+        self.index += 1
+        return self.steps[self.index - 1]
+
+    # board state before the oldest kept step
+    def base(self, current):
+        strokes = list(current)
+        for step in reversed(self.steps[: self.index]):
+            for op in reversed(step):
+                op.revert(strokes)
+        return strokes
+
+    # returns the board at index
+    def load_steps(self, base, steps, index):
+        index = max(0, min(index, len(steps)))
+
+        strokes = list(base)
+        for step in steps[:index]:
+            for op in step:
+                op.apply(strokes)
+
+        self.steps = [tuple(step) for step in steps]
+        self.index = index
+        self.nbytes = sum(step_nbytes(step) for step in self.steps)
+
+        # like push, only trim undo steps: the board is at index, and a step
+        # past it must not become the next redo
+        while self.nbytes > self.max_bytes and self.index > 1:
+            self.nbytes -= step_nbytes(self.steps.pop(0))
+            self.index -= 1
+        return strokes
+
+
+def diff_snapshots(prev, snap):
+    kept_ids = {id(s) for s in snap}
+    removed = tuple((i, s) for i, s in enumerate(prev) if id(s) not in kept_ids)
+
+    prev_ids = {id(s) for s in prev}
+    added = [s for s in snap if id(s) not in prev_ids]
+
+    remaining = [s for s in prev if id(s) in kept_ids]
+    if [id(s) for s in remaining + added] != [id(s) for s in snap]:
+        return [ClearStrokes(tuple(prev))] + [AddStroke(s) for s in snap]
+
+    ops = [RemoveStrokes(removed)] if removed else []
+    return ops + [AddStroke(s) for s in added]
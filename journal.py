@@ -0,0 +1,236 @@
+# journal.py
+# type: ignore
+
+# crash-safe autosave: a v3 session (see session.py) followed by one record
+# per history change since it was written:
+#   {"push": [op, ...]}   a new undo step, ops as in "step"
+#   {"undo": 1} / {"redo": 1}
+#   {"layers": [...]}     layer states after a change
+# new strokes get their stroke line right before the first record using
+# them. Compaction rewrites the file as a plain session of the board.
+
+import json
+import os
+import queue
+import threading
+import time
+
+from history import History
+from session import (
+    op_record,
+    read_header,
+    record_op,
+    record_stroke,
+    replacing,
+    stroke_record,
+    write_record,
+    write_session,
+)
+
+FSYNC_INTERVAL = 0.5  # seconds between fsyncs while records come in
+COMPACT_RECORDS = 2000
+
+
+def default_journal_path():
+    path = os.environ.get("SCREEN_PEN_JOURNAL")
+    return path or os.path.join(os.path.expanduser("~"), ".screen-pen", "journal.jsonl")
+
+
+class Journal:
+    # records are queued on the GUI thread; a writer thread serializes them,
+    # batches the writes and fsyncs at most every FSYNC_INTERVAL. Strokes and
+    # ops are immutable, so the writer can encode them while drawing goes on
+    def __init__(self, path, snapshot):
+        self.path = path
+        self.snapshot = snapshot  # Canva.snapshot, called on the GUI thread
+
+        self.records = 0
+        self.error = None  # set by the writer thread when it gives up
+        self.on_error = None  # called once with it, on the GUI thread
+
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._thread = threading.Thread(target=self.run, name="journal", daemon=True)
+        self._thread.start()
+        self.compact()
+
+    def close(self):
+        if self._thread:
+            self._queue.put(("close", None))
+            self._thread.join()
+            self._thread = None
+
+    # GUI thread
+    def push(self, ops):
+        self.put("push", tuple(ops))
+
+    def undo(self):
+        self.put("undo", None)
+
+    def redo(self):
+        self.put("redo", None)
+
+    def set_layers(self, states):
+        self.put("layers", states)
+
+    def compact(self):
+        self.records = 0
+        self._queue.put(("compact", self.snapshot()))
+
+    def put(self, kind, value):
+        if not self._thread:
+            if self.error and self.on_error:
+                self.on_error(self.error)
+                self.on_error = None
+            return
+
+        self._queue.put((kind, value))
+        self.records += 1
+        if self.records >= COMPACT_RECORDS:
+            self.compact()
+
+    # writer thread
+    def run(self):
+        f = None
+        ids = {}
+        keep = []
+        dirty = False
+        synced = time.monotonic()
+
+        def ref(s):
+            if id(s) not in ids:
+                ids[id(s)] = len(ids)
+                keep.append(s)  # its id must not be reused while it is in ids
+                write_record(f, stroke_record(ids[id(s)], s))
+            return ids[id(s)]
+
+        while True:
+            try:
+                batch = [self._queue.get(timeout=FSYNC_INTERVAL if dirty else None)]
+            except queue.Empty:
+                batch = []  # idle, only the sync below
+
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for kind, value in batch:
+                    if kind == "close":
+                        if f:
+                            f.flush()
+                            os.fsync(f.fileno())
+                            f.close()
+                        return
+
+                    if kind == "compact":
+                        if f:
+                            f.close()
+                        with replacing(self.path) as out:
+                            ids = write_session(out, *value)
+                            out.flush()
+                            os.fsync(out.fileno())
+                        keep = [value]
+                        f = open(self.path, "a", encoding="utf-8")
+                        continue
+
+                    if kind == "push":
+                        write_record(f, {"push": [op_record(op, ref) for op in value]})
+                    elif kind == "layers":
+                        write_record(f, {"layers": list(value)})
+                    else:
+                        write_record(f, {kind: 1})
+
+                if batch:
+                    f.flush()
+                    dirty = True
+                if dirty and (not batch or time.monotonic() - synced >= FSYNC_INTERVAL):
+                    os.fsync(f.fileno())
+                    dirty = False
+                    synced = time.monotonic()
+
+            except OSError as e:
+                # keep drawing, just stop journaling
+                self.error = str(e)
+                self._thread = None
+                if f:
+                    f.close()
+                return
+
+
+def read_journal(path, progress=None):
+    # same result as session.load_session; a torn last line from a crash
+    # mid-write ends the replay
+    with open(path, "r", encoding="utf-8") as f:
+        header = read_header(f)
+        if header is None:
+            raise ValueError(f"Not a drawing journal: {path}")
+
+        total = os.fstat(f.fileno()).st_size
+        done = 0
+
+        pool = {}
+        base = []
+        steps = []
+        history = None
+        strokes = None
+
+        for line in f:
+            done += len(line)
+            if progress:
+                progress(done, total)
+
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+
+            if "stroke" in record:
+                pool[record["stroke"]] = record_stroke(record)
+                continue
+            elif "base" in record:
+                base = [pool[sid] for sid in record["base"]]
+                continue
+            elif "step" in record:
+                steps.append([record_op(op, pool) for op in record["step"]])
+                continue
+            elif "layers" in record:
+                header["layers"] = record["layers"]
+                continue
+
+            # the same History the board uses, so steps are trimmed alike
+            if history is None:
+                history = History()
+                index = header.get("history_index", len(steps))
+                strokes = history.load_steps(base, steps, index)
+
+            if "push" in record:
+                ops = [record_op(op, pool) for op in record["push"]]
+                for op in ops:
+                    op.apply(strokes)
+                history.push(ops)
+
+            elif "undo" in record:
+                step = history.undo()
+                for op in reversed(step or ()):
+                    op.revert(strokes)
+
+            elif "redo" in record:
+                step = history.redo()
+                for op in step or ():
+                    op.apply(strokes)
+
+    if history is None:
+        return header, base, steps
+
+    header["history_index"] = history.index
+    return header, history.base(strokes), list(history.steps)
@@ -0,0 +1,45 @@
+# layers.py
+# type: ignore
+
+from tiles import TileCache
+
+
+class Layer:
+    # strokes refer to their layer by id; each layer keeps its own tiles, so
+    # hiding a layer or drawing on it never re-renders the others
+    def __init__(self, id, name, visible=True, opacity=1.0, locked=False):
+        self.id = id
+        self.name = name
+        self.visible = visible
+        self.opacity = opacity
+        self.locked = locked
+
+        self.tiles = TileCache()
+
+    @property
+    def editable(self):
+        return self.visible and not self.locked
+
+    # JSON ready, also a thread safe snapshot for export
+    def state(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "visible": self.visible,
+            "opacity": self.opacity,
+            "locked": self.locked,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(
+            state["id"],
+            state.get("name", f"Layer {state['id'] + 1}"),
+            state.get("visible", True),
+            state.get("opacity", 1.0),
+            state.get("locked", False),
+        )
+
+
+def default_layers():
+    return [Layer(0, "Layer 1")]
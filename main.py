@@ -1,11 +1,96 @@
 # main.py
 # type: ignore
 
-from PySide2.QtWidgets import QApplication
-from window import Window
+import time
+
+STARTED = time.perf_counter()
+
+from daemon import ControlServer, default_server_name, send_command
+from profiler import startup
+import argparse
+import sys
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Desktop-screen-pen")
+    parser.add_argument(
+        "--all-screens", action="store_true", help="span the overlay over all monitors"
+    )
+    parser.add_argument(
+        "--journal",
+        help="autosave journal, replayed on start (default ~/.screen-pen/journal.jsonl)",
+    )
+    parser.add_argument(
+        "--no-restore", action="store_true", help="start with an empty board"
+    )
+    parser.add_argument(
+        "--resident",
+        action="store_true",
+        help="stay loaded and hidden, quitting only hides the board",
+    )
+    parser.add_argument(
+        "--send",
+        choices=("show", "hide", "toggle", "quit"),
+        help="control the resident board; show and toggle start one if none runs",
+    )
+    parser.add_argument(
+        "--socket",
+        default=default_server_name(),
+        help="control socket name (default screen-pen-<user>)",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print how long each startup phase took",
+    )
+    args = parser.parse_args()
+    if args.profile_startup:
+        startup.begin(STARTED)
+
+    # a resident board takes over before anything heavy is imported
+    reply = send_command(
+        args.send or ("ping" if args.resident else "show"), args.socket
+    )
+    if reply is not None:
+        print(reply)
+        sys.exit(0)
+    if args.send in ("hide", "quit"):
+        print("no resident board", file=sys.stderr)
+        sys.exit(1)
+
+    startup.mark("arguments, resident check")
+
+    from PySide2.QtWidgets import QApplication
+    from PySide2.QtCore import QTimer
+    from journal import default_journal_path
+    from window import Window
+
+    startup.mark("imports")
+
+    resident = args.resident or args.send is not None
     app = QApplication([])
-    w = Window()
-    w.show()
+    startup.mark("QApplication")
+
+    w = Window(all_screens=args.all_screens, show=False)
+    w.controller.open_journal(
+        args.journal or default_journal_path(), restore=not args.no_restore
+    )
+    startup.mark("journal (restore runs on)")
+
+    if resident:
+        server = ControlServer(w.controller, args.socket)
+        w.controller.resident = server.listen()
+        startup.mark("control socket")
+
+    if not args.resident or args.send:
+        w.present()
+        startup.mark("show")
+
+    if args.profile_startup:
+        # runs once the event loop has handled the first paint
+        def report():
+            startup.mark("first frame")
+            print(startup.report(), file=sys.stderr, end="")
+
+        QTimer.singleShot(0, report)
+
     app.exec_()
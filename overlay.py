@@ -0,0 +1,172 @@
+# overlay.py
+# type: ignore
+
+from PySide2.QtGui import QColor, QFont, QPainter, QPen
+from PySide2.QtCore import Qt, QPoint, QRect, QTimer
+from PySide2.QtWidgets import QWidget
+import time
+
+
+class Overlay(QWidget):
+    # cursor ring, size popup, task message and HUD above the board. Input
+    # goes through to the board and nothing here draws strokes, so moving
+    # the cursor only repaints the few pixels around it
+    def __init__(self, window):
+        super().__init__(window)
+
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(Qt.WA_NoSystemBackground)
+        self.setFocusPolicy(Qt.NoFocus)
+
+        self.cursor_pos: QPoint | None = None
+        self.popup_value = 0
+        self._cursor_rect = QRect()
+
+        self.task_text = ""
+
+        self.show_hud = False
+        self.hud_timer = QTimer(self, interval=500)
+        self.hud_timer.timeout.connect(lambda: self.update(self.hud_rect()))
+
+        # built once, not per frame
+        self.ring_pen = QPen(QColor(255, 120, 0))
+        self.ring_pen.setWidth(2)
+        self.popup_pen = QPen(QColor(255, 200, 80))
+        self.popup_pen.setWidth(2)
+        self.text_color = QColor(255, 200, 80)
+        self.panel_color = QColor(0, 0, 0, 160)
+
+        self.popup_font = QFont("Microsoft JhengHei")
+        self.popup_font.setPixelSize(15)
+        self.popup_font.setBold(True)
+        self.task_font = QFont("Microsoft JhengHei")
+        self.task_font.setPixelSize(15)
+        self.hud_font = QFont("Consolas")
+        self.hud_font.setPixelSize(13)
+
+    def paintEvent(self, event):
+        start = time.perf_counter_ns()
+        dirty = event.rect()
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        if self._cursor_rect.intersects(dirty):
+            self.draw_cursor(painter)
+
+        if self.task_text and self.task_rect().intersects(dirty):
+            self.draw_task(painter)
+
+        if self.show_hud and self.hud_rect().intersects(dirty):
+            self.draw_hud(painter)
+
+        painter.end()
+
+        if self.profiler.enabled:
+            self.profiler.record("Overlay.paintEvent", time.perf_counter_ns() - start)
+
+    # cursor ring and size popup
+    def move_cursor(self, pos):
+        self.cursor_pos = pos
+        self.update_cursor()
+
+    def show_popup(self, value):
+        self.popup_value = value
+        self.update_cursor()
+
+    def cursor_rect(self):
+        if not self.cursor_pos:
+            return QRect()
+
+        rect = QRect()
+        x, y = self.cursor_pos.x(), self.cursor_pos.y()
+
+        if self.controller.tool == "eraser":
+            r = self.controller.size // 2 + 2
+            rect |= QRect(x - r, y - r, 2 * r + 1, 2 * r + 1)
+
+        if self.popup_value:
+            r = self.popup_value // 2 + 2
+            rect |= QRect(x - r, y - r, 2 * r + 1, 2 * r + 1)
+            rect |= QRect(x + 18, y - 42, 70, 28)
+
+        return rect
+
+    def update_cursor(self):
+        old = self._cursor_rect
+        self._cursor_rect = self.cursor_rect()
+
+        damage = old | self._cursor_rect
+        if not damage.isEmpty():
+            self.update(damage)
+
+    def draw_cursor(self, p: QPainter):
+        if not self.cursor_pos:
+            return
+
+        if self.controller.tool == "eraser":
+            p.setPen(self.ring_pen)
+            p.setBrush(Qt.NoBrush)
+
+            r = self.controller.size / 2
+            p.drawEllipse(self.cursor_pos, r, r)
+
+        if self.popup_value:
+            p.setPen(self.popup_pen)
+            p.setBrush(Qt.NoBrush)
+
+            r = self.popup_value / 2
+            p.drawEllipse(self.cursor_pos, r, r)
+
+            p.setFont(self.popup_font)
+            p.drawText(self.cursor_pos + QPoint(21, -21), f"{self.popup_value}px")
+
+            # shown until the next cursor move
+            self.popup_value = 0
+
+    # background task message
+    def task_rect(self):
+        return QRect(self.width() // 2 - 160, self.height() - 60, 320, 30)
+
+    def show_task(self, text):
+        self.task_text = text
+        self.update(self.task_rect())
+
+    def draw_task(self, painter):
+        rect = self.task_rect()
+        painter.fillRect(rect, self.panel_color)
+
+        painter.setFont(self.task_font)
+        painter.setPen(self.text_color)
+        painter.drawText(rect, Qt.AlignCenter, self.task_text)
+
+    # HUD
+    def hud_rect(self):
+        return QRect(10, 10, 220, 116)
+
+    def set_hud(self, show):
+        self.show_hud = show
+        if show:
+            self.hud_timer.start()
+        else:
+            self.hud_timer.stop()
+        self.update(self.hud_rect())
+
+    def draw_hud(self, painter):
+        canva = self.canva
+        points = sum(len(s.xy) for s in canva.strokes)
+        lines = [
+            f"FPS    {self.profiler.fps()}",
+            f"paint  {self.profiler.last_paint_ms():.2f} ms",
+            f"stroke {len(canva.strokes)}",
+            f"points {points}",
+            f"undo   {len(canva.history)} / {canva.history.nbytes / 1048576:.1f} MB",
+            f"zoom   {canva.view_scale * 100:.0f}%",
+        ]
+
+        rect = self.hud_rect()
+        painter.fillRect(rect, self.panel_color)
+
+        painter.setFont(self.hud_font)
+        painter.setPen(self.text_color)
+        painter.drawText(rect.adjusted(8, 6, -8, -6), Qt.AlignLeft, "\n".join(lines))
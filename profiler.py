@@ -0,0 +1,139 @@
+# profiler.py
+# type: ignore
+
+from collections import deque
+import functools
+import os
+import time
+
+
+class Profiler:
+    def __init__(self, path=None):
+        self.enabled = False
+        self.path = path or os.environ.get("SCREEN_PEN_PROFILE")
+
+        self.stats: dict[str, list] = {}  # name -> [calls, total ns, max ns]
+        self.frames = deque(maxlen=240)
+        self.targets = []
+        self._patched = []
+
+    # instrumentation, patched onto the instances only while enabled
+    def watch(self, obj, *names):
+        self.targets.append((obj, names))
+        if self.enabled:
+            self.patch(obj, names)
+
+    def patch(self, obj, names):
+        for name in names:
+            label = f"{type(obj).__name__}.{name}"
+            setattr(obj, name, self.wrap(getattr(obj, name), label))
+            self._patched.append((obj, name))
+
+    def wrap(self, func, label):
+        stats = self.stats.setdefault(label, [0, 0, 0])
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                ns = time.perf_counter_ns() - start
+                stats[0] += 1
+                stats[1] += ns
+                stats[2] = max(stats[2], ns)
+
+        return timed
+
+    def start(self):
+        if self.enabled:
+            return
+
+        self.enabled = True
+        for obj, names in self.targets:
+            self.patch(obj, names)
+
+    def stop(self):
+        for obj, name in self._patched:
+            delattr(obj, name)
+
+        self._patched = []
+        self.enabled = False
+
+    def record(self, label, ns):
+        stats = self.stats.setdefault(label, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += ns
+        stats[2] = max(stats[2], ns)
+
+    # frames
+    def frame(self, ns):
+        self.frames.append((time.monotonic(), ns))
+        self.record("Canva.paintEvent", ns)
+
+    def fps(self):
+        now = time.monotonic()
+        return sum(1 for t, _ in self.frames if now - t <= 1)
+
+    def last_paint_ms(self):
+        return self.frames[-1][1] / 1e6 if self.frames else 0
+
+    # report
+    def report(self):
+        lines = [
+            f"{'function':<32}{'calls':>8}{'total ms':>12}{'avg ms':>10}{'max ms':>10}"
+        ]
+        ranked = sorted(self.stats.items(), key=lambda item: -item[1][1])
+
+        for label, (calls, total, peak) in ranked:
+            if not calls:
+                continue
+            lines.append(
+                f"{label:<32}{calls:>8}{total / 1e6:>12.2f}"
+                f"{total / calls / 1e6:>10.3f}{peak / 1e6:>10.3f}"
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        if not any(calls for calls, _, _ in self.stats.values()):
+            return
+
+        path = self.path
+        if not path:
+            download = os.path.join(os.path.expanduser("~"), "Downloads")
+            path = os.path.join(download, "screen-pen-profile.txt")
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+
+
+class StartupProfile:
+    # wall time of each startup phase, main.py --profile-startup prints it
+    def __init__(self):
+        self.enabled = False
+        self.started = 0.0
+        self.marks = []
+
+    def begin(self, started):
+        self.enabled = True
+        self.started = started
+
+    def mark(self, label):
+        if self.enabled:
+            self.marks.append((label, time.perf_counter()))
+
+    def report(self):
+        lines = [f"{'startup phase':<32}{'ms':>10}{'total ms':>12}"]
+
+        last = self.started
+        for label, t in self.marks:
+            lines.append(
+                f"{label:<32}{(t - last) * 1000:>10.1f}{(t - self.started) * 1000:>12.1f}"
+            )
+            last = t
+
+        return "\n".join(lines) + "\n"
+
+
+startup = StartupProfile()
@@ -0,0 +1,264 @@
+# session.py
+# type: ignore
+
+# v3 drawing format, JSON Lines:
+#   {"app": ..., "version": 3, "board_color": [...], "history_index": n, "layers": [...]}
+#   {"stroke": id, "shape": ..., "color": [...], "size": ..., "round_cap": ..., "layer": ..., "points": [...]}
+#   {"base": [id, ...]}
+#   {"step": [["add", id] | ["remove", [[index, id], ...]] | ["clear", [id, ...]]
+#             | ["split", index, id, [piece id, ...]], ...]}
+# strokes are written once, before their first use; points are the first
+# x, y followed by the x, y deltas to the previous point. "layers" lists
+# id, name, visible, opacity and locked bottom to top, strokes without
+# "layer" are on layer 0. Version 3 adds "poly" strokes and "split" steps,
+# version 2 files are read the same way
+
+from contextlib import contextmanager
+import json
+import os
+import tempfile
+
+from PySide2.QtGui import QColor
+import numpy as np
+
+from history import AddStroke, RemoveStrokes, ClearStrokes, SplitStroke
+from history import diff_snapshots
+from stroke import Stroke
+
+APP = "Desktop-screen-pen"
+VERSION = 3
+READ_VERSIONS = (2, 3)
+
+
+def encode_points(xy):
+    delta = xy.copy()
+    delta[1:] -= xy[:-1]
+    return delta.ravel().tolist()
+
+
+def decode_points(flat):
+    delta = np.array(flat, dtype=np.int32).reshape(-1, 2)
+    return np.cumsum(delta, axis=0, dtype=np.int32)
+
+
+def stroke_record(sid, s):
+    c = s.color
+    record = {
+        "stroke": sid,
+        "shape": s.shape,
+        "color": [c.red(), c.green(), c.blue(), c.alpha()],
+        "size": s.size,
+        "round_cap": s.round_cap,
+    }
+    if s.layer:
+        record["layer"] = s.layer
+
+    record["points"] = encode_points(s.xy)
+    return record
+
+
+def record_stroke(record):
+    return Stroke(
+        record["shape"],
+        QColor(*record["color"]).rgba(),
+        record["size"],
+        record.get("round_cap", False),
+        decode_points(record["points"]),
+        layer=record.get("layer", 0),
+    )
+
+
+def op_record(op, ref):
+    if isinstance(op, AddStroke):
+        return ["add", ref(op.stroke)]
+    elif isinstance(op, RemoveStrokes):
+        return ["remove", [[i, ref(s)] for i, s in op.removed]]
+    elif isinstance(op, ClearStrokes):
+        return ["clear", [ref(s) for s in op.strokes]]
+    elif isinstance(op, SplitStroke):
+        return ["split", op.index, ref(op.stroke), [ref(s) for s in op.pieces]]
+    raise ValueError(f"Unknown history op: {op!r}")
+
+
+def record_op(record, pool):
+    kind = record[0]
+    if kind == "add":
+        return AddStroke(pool[record[1]])
+    elif kind == "remove":
+        return RemoveStrokes(tuple((i, pool[sid]) for i, sid in record[1]))
+    elif kind == "clear":
+        return ClearStrokes(tuple(pool[sid] for sid in record[1]))
+    elif kind == "split":
+        _, index, sid, pieces = record
+        return SplitStroke(index, pool[sid], tuple(pool[p] for p in pieces))
+    raise ValueError(f"Unknown history op: {kind!r}")
+
+
+def write_record(f, record):
+    f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+    f.write("\n")
+
+
+@contextmanager
+def replacing(path, mode="w"):
+    # written next to the target and swapped in, so a failed or cancelled
+    # write never leaves a half written file behind
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+
+    try:
+        encoding = None if "b" in mode else "utf-8"
+        with open(fd, mode, encoding=encoding) as f:
+            yield f
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def write_session(f, board_color, history, current, layers=(), progress=None):
+    # returns the stroke ids, id(stroke) -> id in the file
+    ids = {}
+
+    def ref(s):
+        if id(s) not in ids:
+            ids[id(s)] = len(ids)
+            write_record(f, stroke_record(ids[id(s)], s))
+        return ids[id(s)]
+
+    header = {
+        "app": APP,
+        "version": VERSION,
+        "board_color": list(board_color),
+        "history_index": history.index,
+    }
+    if layers:
+        header["layers"] = list(layers)
+    write_record(f, header)
+
+    base = history.base(current)
+    total = len(base) + len(history.steps)
+
+    base_ids = []
+    for i, s in enumerate(base):
+        base_ids.append(ref(s))
+        if progress:
+            progress(i + 1, total)
+    write_record(f, {"base": base_ids})
+
+    for i, step in enumerate(history.steps):
+        ops = [op_record(op, ref) for op in step]
+        write_record(f, {"step": ops})
+
+        if progress:
+            progress(len(base) + i + 1, total)
+
+    return ids
+
+
+def save_session(path, board_color, history, current, layers=(), progress=None):
+    with replacing(path) as f:
+        write_session(f, board_color, history, current, layers, progress)
+
+
+def read_header(f):
+    # None for anything that is not a v2 or v3 file, e.g. a v1 single JSON object
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        return None
+
+    if not isinstance(header, dict) or header.get("version") not in READ_VERSIONS:
+        return None
+    return header
+
+
+def read_session(f, progress=None):
+    total = os.fstat(f.fileno()).st_size
+    done = 0
+
+    pool = {}
+    base = []
+    steps = []
+
+    for line in f:
+        done += len(line)
+        if progress:
+            progress(done, total)
+
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+        if "stroke" in record:
+            pool[record["stroke"]] = record_stroke(record)
+        elif "base" in record:
+            base = [pool[sid] for sid in record["base"]]
+        elif "step" in record:
+            steps.append([record_op(op, pool) for op in record["step"]])
+
+    return base, steps
+
+
+# v1 files, one full board snapshot per history step
+def json_to_stroke(data):
+    shape = data["shape"]
+
+    if shape == "free":
+        xy = data["points"]
+
+    elif shape == "line":
+        xy = [data["start"], data["end"]]
+
+    elif shape == "rect":
+        x, y, w, h = data["rect"]
+        xy = [(x, y), (x + w - 1, y + h - 1)]
+
+    return Stroke(
+        shape,
+        QColor(*data["color"]).rgba(),
+        data["size"],
+        data.get("round_cap", False),
+        xy,
+        layer=data.get("layer", 0),
+    )
+
+
+def read_v1(data, progress=None):
+    # equal strokes in consecutive snapshots become one shared object
+    pool = {}
+    snaps = []
+    history = data.get("history", [[]])
+
+    for i, snap in enumerate(history):
+        seen = {}
+        strokes = []
+        for d in snap:
+            key = json.dumps(d, sort_keys=True)
+            n = seen[key] = seen.get(key, -1) + 1
+            if (key, n) not in pool:
+                pool[key, n] = json_to_stroke(d)
+            strokes.append(pool[key, n])
+        snaps.append(strokes)
+
+        if progress:
+            progress(i + 1, len(history))
+
+    header = {
+        "board_color": data.get("board_color", (0, 0, 0, 50)),
+        "history_index": data.get("history_index", len(snaps) - 1),
+    }
+    steps = [diff_snapshots(prev, snap) for prev, snap in zip(snaps, snaps[1:])]
+    return header, snaps[0], steps
+
+
+def load_session(path, progress=None):
+    with open(path, "r", encoding="utf-8") as f:
+        header = read_header(f)
+        if header:
+            return (header, *read_session(f, progress))
+
+        f.seek(0)
+        data = json.load(f)
+
+    return read_v1(data, progress)
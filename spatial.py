@@ -0,0 +1,92 @@
+# spatial.py
+# type: ignore
+
+# items spanning more cells than this, e.g. a stroke drawn zoomed far out,
+# are kept aside and checked on every query instead of filling the grid
+MAX_CELLS = 256
+
+
+def bounds_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class GridIndex:
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+
+        self.cells: dict[tuple, set] = {}
+        self.bounds: dict[int, tuple] = {}
+        self.items: dict[int, object] = {}
+        self.large: set[int] = set()
+
+    def __len__(self):
+        return len(self.items)
+
+    def cell_range(self, bounds):
+        x0, y0, x1, y1 = bounds
+        c = self.cell_size
+        return int(x0) // c, int(y0) // c, int(x1) // c, int(y1) // c
+
+    def cell_count(self, bounds):
+        cx0, cy0, cx1, cy1 = self.cell_range(bounds)
+        return (cx1 - cx0 + 1) * (cy1 - cy0 + 1)
+
+    def cells_for(self, bounds):
+        cx0, cy0, cx1, cy1 = self.cell_range(bounds)
+
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                yield cx, cy
+
+    def insert(self, item, bounds):
+        key = id(item)
+        self.items[key] = item
+        self.bounds[key] = bounds
+
+        if self.cell_count(bounds) > MAX_CELLS:
+            self.large.add(key)
+            return
+
+        for cell in self.cells_for(bounds):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, item):
+        key = id(item)
+        bounds = self.bounds.pop(key, None)
+        if bounds is None:
+            return
+
+        del self.items[key]
+        if key in self.large:
+            self.large.discard(key)
+            return
+
+        for cell in self.cells_for(bounds):
+            keys = self.cells.get(cell)
+            if keys is None:
+                continue
+
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.bounds.clear()
+        self.items.clear()
+        self.large.clear()
+
+    def query(self, bounds):
+        # a query over more cells than there are items checks every item
+        if self.cell_count(bounds) > len(self.items):
+            found = self.items
+        else:
+            found = set(self.large)
+            for cell in self.cells_for(bounds):
+                keys = self.cells.get(cell)
+                if keys:
+                    found |= keys
+
+        return [
+            self.items[key] for key in found if bounds_overlap(self.bounds[key], bounds)
+        ]
@@ -0,0 +1,156 @@
+# stroke.py
+# type: ignore
+
+from PySide2.QtGui import QColor, QPainterPath
+from PySide2.QtCore import QPoint, QRect
+import numpy as np
+import math
+
+from geometry import array_bounds, simplify_polyline
+
+
+def free_curve_path(pts):
+    path = QPainterPath()
+    path.moveTo(pts[0])
+
+    for i in range(1, len(pts) - 1):
+        mid = (pts[i] + pts[i + 1]) / 2
+        path.quadTo(pts[i], mid)
+
+    path.lineTo(pts[-1])
+    return path
+
+
+class Stroke:
+    # committed strokes are shared by the board and the history, never mutate them
+    __slots__ = (
+        "shape",
+        "rgba",
+        "size",
+        "round_cap",
+        "xy",
+        "bounds",
+        "layer",
+        "_path",
+        "_paint_rect",
+        "_lod",
+    )
+
+    def __init__(
+        self,
+        shape: str,
+        rgba: int,
+        size: int,
+        round_cap: bool,
+        xy,
+        bounds=None,
+        layer: int = 0,
+    ):
+        xy = np.ascontiguousarray(xy, dtype=np.int32).reshape(-1, 2)
+        xy.flags.writeable = False
+
+        self.shape = shape
+        self.rgba = rgba
+        self.size = size
+        self.round_cap = round_cap
+        self.xy = xy
+        self.bounds = bounds or array_bounds(xy)
+        self.layer = layer
+
+        self.drop_cache()
+
+    @classmethod
+    def free(cls, brush, pts, tolerance=0, layer=0):
+        # simplified at full precision, then put on the integer grid
+        xy = np.array([(p.x(), p.y()) for p in pts], dtype=np.float64)
+        xy = np.rint(simplify_polyline(xy, tolerance))
+        return cls(
+            "free", brush.color.rgba(), brush.size, brush.round_cap, xy, layer=layer
+        )
+
+    @classmethod
+    def line(cls, brush, start, end, layer=0):
+        xy = [(start.x(), start.y()), (end.x(), end.y())]
+        return cls(
+            "line", brush.color.rgba(), brush.size, brush.round_cap, xy, layer=layer
+        )
+
+    @classmethod
+    def rect(cls, brush, start, end, layer=0):
+        r = QRect(start, end).normalized()
+        xy = [(r.left(), r.top()), (r.right(), r.bottom())]
+        return cls(
+            "rect", brush.color.rgba(), brush.size, brush.round_cap, xy, layer=layer
+        )
+
+    @property
+    def color(self):
+        return QColor.fromRgba(self.rgba)
+
+    @property
+    def style(self):
+        # everything the pen depends on
+        return self.rgba, self.size, self.round_cap
+
+    @property
+    def nbytes(self):
+        return 120 + self.xy.nbytes
+
+    def points(self):
+        return [QPoint(x, y) for x, y in self.xy.tolist()]
+
+    def qrect(self):
+        (x0, y0), (x1, y1) = self.xy.tolist()
+        return QRect(QPoint(x0, y0), QPoint(x1, y1))
+
+    # render cache, built lazily and kept while the stroke is on the board
+    def drop_cache(self):
+        self._path = None
+        self._paint_rect = None
+        self._lod = None
+
+    def path(self):
+        if self._path is None:
+            if self.shape == "free":
+                self._path = free_curve_path(self.points())
+            elif self.shape == "line":
+                self._path = QPainterPath()
+                start, end = self.points()
+                self._path.moveTo(start)
+                self._path.lineTo(end)
+            elif self.shape == "poly":
+                # straight segments, what is left of a cut rectangle
+                self._path = QPainterPath()
+                start, *rest = self.points()
+                self._path.moveTo(start)
+                for p in rest:
+                    self._path.lineTo(p)
+            else:
+                self._path = QPainterPath()
+                self._path.addRect(self.qrect())
+        return self._path
+
+    def lod_path(self, zoom):
+        # free strokes drawn below 1:1 are simplified to half a device pixel,
+        # one cached path per halving of the zoom
+        if zoom > 0.5 or self.shape != "free" or len(self.xy) < 3:
+            return self.path()
+
+        level = int(-math.log2(zoom))
+        if self._lod is None:
+            self._lod = {}
+        if level not in self._lod:
+            xy = simplify_polyline(self.xy, 0.5 * 2**level)
+            self._lod[level] = free_curve_path([QPoint(x, y) for x, y in xy.tolist()])
+        return self._lod[level]
+
+    def paint_rect(self):
+        # curves stay inside their control points and the pen (bevel joins,
+        # round or flat caps) reaches size / 2 past them, plus antialiasing
+        if self._paint_rect is None:
+            x0, y0, x1, y1 = self.bounds
+            pad = self.size // 2 + 2
+            self._paint_rect = QRect(
+                x0 - pad, y0 - pad, x1 - x0 + 2 * pad + 1, y1 - y0 + 2 * pad + 1
+            )
+        return self._paint_rect
@@ -0,0 +1,147 @@
+# tiles.py
+# type: ignore
+
+import math
+
+from PySide2.QtGui import QImage, QPainter
+from PySide2.QtCore import Qt, QRect
+
+from spatial import GridIndex
+
+TILE_SIZE = 256
+
+
+def rect_bounds(rect):
+    return rect.left(), rect.top(), rect.right(), rect.bottom()
+
+
+class TileCache:
+    # stroke rasters in fixed-size tiles of the zoomed board (world * scale),
+    # each built from the strokes whose painted area touches it; tiles are
+    # rendered the first time they are drawn and a tile without strokes is
+    # kept as None. Panning reuses the tiles, zooming rebuilds them.
+    def __init__(self, size=TILE_SIZE):
+        self.size = size
+        self.ratio = 1.0
+        self.scale = 1.0
+
+        self.index = GridIndex(size)  # world paint bounds
+        self.tiles: dict[tuple, QImage | None] = {}
+        self._order = None
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def tile_rect(self, key):
+        tx, ty = key
+        return QRect(tx * self.size, ty * self.size, self.size, self.size)
+
+    def tile_bounds(self, key):
+        # world bounds covered by a tile
+        tx, ty = key
+        s = self.size / self.scale
+        return tx * s, ty * s, (tx + 1) * s, (ty + 1) * s
+
+    def keys_in(self, zoomed):
+        if zoomed.isEmpty():
+            return []
+        return list(self.index.cells_for(rect_bounds(zoomed)))
+
+    def keys_for(self, rect):
+        # tiles under a world rect
+        if rect.isEmpty():
+            return []
+
+        x0, y0, x1, y1 = rect_bounds(rect)
+        s = self.scale
+        c = self.size
+        return [
+            (tx, ty)
+            for tx in range(math.floor(x0 * s) // c, math.floor((x1 + 1) * s) // c + 1)
+            for ty in range(math.floor(y0 * s) // c, math.floor((y1 + 1) * s) // c + 1)
+        ]
+
+    # strokes
+    def insert(self, s):
+        self.index.insert(s, rect_bounds(s.paint_rect()))
+        self._order = None
+
+    def remove(self, s, rect=None):
+        # rect: the part of s whose pixels change, all of it by default
+        self.invalidate(s.paint_rect() if rect is None else rect)
+        self.index.remove(s)
+        self._order = None
+
+    def clear(self):
+        self.index.clear()
+        self.tiles.clear()
+        self._order = None
+
+    def invalidate(self, rect=None):
+        if rect is None:
+            self.tiles.clear()
+            return
+
+        for key in self.keys_for(rect):
+            self.tiles.pop(key, None)
+
+    def bake(self, s, draw):
+        # s is on top of every other stroke, draw it into the built tiles;
+        # draw(painter, strokes) paints strokes in order
+        for key in self.keys_for(s.paint_rect()):
+            if key not in self.tiles:
+                continue
+
+            image = self.tiles[key]
+            if image is None:
+                del self.tiles[key]
+                continue
+
+            painter = self.tile_painter(image, key)
+            draw(painter, (s,))
+            painter.end()
+
+    # rendering
+    def set_view(self, scale, ratio):
+        if scale != self.scale or ratio != self.ratio:
+            self.scale = scale
+            self.ratio = ratio
+            self.tiles.clear()
+
+    def tile(self, key, strokes, draw):
+        if key not in self.tiles:
+            self.tiles[key] = self.render(key, strokes, draw)
+        return self.tiles[key]
+
+    def tile_painter(self, image, key):
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.translate(-key[0] * self.size, -key[1] * self.size)
+        painter.scale(self.scale, self.scale)
+        return painter
+
+    def query(self, bounds, strokes):
+        # strokes painting into world bounds, in board order
+        items = self.index.query(bounds)
+
+        if self._order is None:
+            self._order = {id(s): i for i, s in enumerate(strokes)}
+        order = self._order
+        items.sort(key=lambda s: order[id(s)])
+        return items
+
+    def render(self, key, strokes, draw):
+        items = self.query(self.tile_bounds(key), strokes)
+        if not items:
+            return None
+
+        side = math.ceil(self.size * self.ratio)
+        image = QImage(side, side, QImage.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(self.ratio)
+        image.fill(Qt.transparent)
+
+        painter = self.tile_painter(image, key)
+        draw(painter, items)
+        painter.end()
+
+        return image
@@ -1,55 +1,109 @@
 # toolbar.py
 # type: ignore
 
-from PySide2.QtWidgets import QPushButton, QFrame, QHBoxLayout, QMenu
-from PySide2.QtGui import QColor, QPainter, QPen, QIcon
+from PySide2.QtWidgets import QApplication, QPushButton, QFrame, QHBoxLayout, QMenu
+from PySide2.QtGui import QColor, QImage, QPainter, QPen, QIcon, QPixmap, QPolygon
 from PySide2.QtCore import Qt, QSize, QPoint
+from PySide2.QtSvg import QSvgRenderer
+import functools
+import math
 import os
 
+ICON_SIDE = 41
 
-def get_icon(path: str):
+
+def get_icon(path: str, side=ICON_SIDE):
+    return render_icon(path, side, QApplication.instance().devicePixelRatio())
+
+
+@functools.lru_cache(maxsize=None)
+def render_icon(path, side, ratio):
+    # each SVG is parsed and rasterized once per size and pixel ratio
     base = os.path.dirname(os.path.abspath(__file__))
     full = os.path.join(base, "image", "toolbar", path)
-    return QIcon(full)
 
+    image = QImage(
+        math.ceil(side * ratio),
+        math.ceil(side * ratio),
+        QImage.Format_ARGB32_Premultiplied,
+    )
+    image.fill(Qt.transparent)
+    p = QPainter(image)
+    QSvgRenderer(full).render(p)
+    p.end()
+
+    pixmap = QPixmap.fromImage(image)
+    pixmap.setDevicePixelRatio(ratio)
+    return QIcon(pixmap)
+
+
+class SpriteButton(QPushButton):
+    # the glyph of each state is drawn once into a pixmap shared by the
+    # process; refresh() repaints only when the state really changed.
+    # Subclasses define state(), what the glyph shows, and draw(p, state)
+    sprites: dict[tuple, QPixmap] = {}
 
-class SizeButton(QPushButton):
     def __init__(self, controller, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.controller = controller
         self.setFixedSize(52, 52)
+        self._state = None
+
+    def refresh(self):
+        state = self.state()
+        if state != self._state:
+            self._state = state
+            self.update()
+
+    def sprite(self):
+        ratio = self.devicePixelRatioF()
+        key = (type(self).__name__, self.state(), ratio)
+
+        if key not in self.sprites:
+            pixmap = QPixmap(self.size() * ratio)
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(Qt.transparent)
+
+            p = QPainter(pixmap)
+            p.setRenderHint(QPainter.Antialiasing)
+            p.setFont(self.font())
+            self.draw(p, key[1])
+            p.end()
+            self.sprites[key] = pixmap
+
+        return self.sprites[key]
 
     def paintEvent(self, event):
         super().paintEvent(event)
 
         p = QPainter(self)
-        p.setRenderHint(QPainter.Antialiasing)
+        p.drawPixmap(0, 0, self.sprite())
+
+
+class SizeButton(SpriteButton):
+    def state(self):
+        return self.controller.size
+
+    def draw(self, p, size):
         p.setPen(QPen(QColor(255, 255, 255), 3))
         p.setBrush(Qt.NoBrush)
 
         cx = self.width() // 2
         cy = self.height() // 2
-        r = min(18, self.controller.size / 2)
+        r = min(18, size / 2)
         p.drawEllipse(QPoint(cx, cy), r, r)
 
 
-class ShapeButton(QPushButton):
-    def __init__(self, controller, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.controller = controller
-        self.setFixedSize(52, 52)
-
-    def paintEvent(self, event):
-        super().paintEvent(event)
+class ShapeButton(SpriteButton):
+    def state(self):
+        return self.controller.shape
 
-        p = QPainter(self)
-        p.setRenderHint(QPainter.Antialiasing)
+    def draw(self, p, shape):
         p.setPen(QPen(QColor(255, 255, 255), 3))
 
         cx = self.width() // 2
         cy = self.height() // 2
 
-        shape = self.controller.shape
         if shape == "free":
             font = p.font()
             font.setFamily("Microsoft JhengHei")
@@ -65,27 +119,56 @@ class ShapeButton(QPushButton):
             p.drawRect(cx - 12, cy - 12, 24, 24)
 
 
-class ColorButton(QPushButton):
-    def __init__(self, controller, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.controller = controller
-        self.setFixedSize(52, 52)
+class ColorButton(SpriteButton):
+    def state(self):
+        return self.controller.color.rgba()
 
-    def paintEvent(self, event):
-        super().paintEvent(event)
-
-        p = QPainter(self)
-        p.setRenderHint(QPainter.Antialiasing)
+    def draw(self, p, rgba):
         p.setPen(QPen(QColor(255, 255, 255), 3))
-
-        c = self.controller.color
-        p.setBrush(c)
+        p.setBrush(QColor.fromRgba(rgba))
 
         x = (self.width()) // 2
         y = (self.height()) // 2
         p.drawRoundedRect(x - 13, y - 13, 26, 26, 8, 8)
 
 
+class LayerButton(SpriteButton):
+    def state(self):
+        canva = self.controller.canva
+        layer = canva.layer()
+        return canva.layers.index(layer) + 1, layer.editable
+
+    def draw(self, p, state):
+        position, editable = state
+        cx = self.width() // 2
+        cy = self.height() // 2
+
+        # two stacked sheets, the active layer number on the top one
+        for dy, alpha in ((6, 120), (-4, 255)):
+            p.setPen(QPen(QColor(255, 255, 255, alpha), 2))
+            p.setBrush(QColor(85, 85, 85))
+            p.drawPolygon(
+                QPolygon(
+                    [
+                        QPoint(cx, cy + dy - 10),
+                        QPoint(cx + 17, cy + dy),
+                        QPoint(cx, cy + dy + 10),
+                        QPoint(cx - 17, cy + dy),
+                    ]
+                )
+            )
+
+        font = p.font()
+        font.setFamily("Microsoft JhengHei")
+        font.setPixelSize(13)
+        font.setBold(True)
+        p.setFont(font)
+
+        color = QColor(255, 120, 0) if not editable else QColor(255, 255, 255)
+        p.setPen(color)
+        p.drawText(self.rect().translated(0, -4), Qt.AlignCenter, str(position))
+
+
 class Toolbar(QFrame):
     def __init__(self, window, controller):
         super().__init__(window)
@@ -132,62 +215,106 @@ class Toolbar(QFrame):
         layout.setSpacing(10)
 
         def icon_btn(path, scale=0.8):
+            side = int(52 * scale)
             btn = QPushButton()
             btn.setFixedSize(52, 52)
-            btn.setIcon(get_icon(path))
-            btn.setIconSize(QSize(int(52 * scale), int(52 * scale)))
+            btn.setIcon(get_icon(path, side))
+            btn.setIconSize(QSize(side, side))
             layout.addWidget(btn)
             return btn
 
+        def lazy_menu(btn, fill):
+            # filled the first time it opens
+            menu = QMenu(self)
+            menu.aboutToShow.connect(lambda: menu.isEmpty() and fill(menu))
+            btn.setMenu(menu)
+            return menu
+
         # board
         btn_board = icon_btn("board.svg")
         btn_board.clicked.connect(controller.toggle_board)
 
         # tool (self)
-        self.btn_tool = icon_btn(f"tools/{self.controller.tool}.svg")
-        tool_menu = QMenu(self)
-        tool_menu.addAction(
+        self._tool = self.controller.tool
+        self.btn_tool = icon_btn(f"tools/{self._tool}.svg")
+        lazy_menu(self.btn_tool, self.fill_tool_menu)
+
+        # size (self)
+        self.btn_size = SizeButton(controller)
+        layout.addWidget(self.btn_size)
+        lazy_menu(self.btn_size, self.fill_size_menu)
+
+        # shape (self)
+        self.btn_shape = ShapeButton(controller)
+        layout.addWidget(self.btn_shape)
+        lazy_menu(self.btn_shape, self.fill_shape_menu)
+
+        # color (self)
+        self.btn_color = ColorButton(controller)
+        layout.addWidget(self.btn_color)
+        lazy_menu(self.btn_color, self.fill_color_menu)
+
+        # layer (self), the menu is rebuilt every time it opens
+        self.btn_layer = LayerButton(controller)
+        layout.addWidget(self.btn_layer)
+        self.layer_menu = QMenu(self)
+        self.layer_menu.aboutToShow.connect(self.fill_layer_menu)
+        self.btn_layer.setMenu(self.layer_menu)
+
+        # save
+        btn_save = icon_btn("save.svg")
+        lazy_menu(btn_save, self.fill_save_menu)
+
+        # undo
+        btn_undo = icon_btn("undo.svg")
+        btn_undo.clicked.connect(controller.undo)
+
+        # redo
+        btn_redo = icon_btn("redo.svg")
+        btn_redo.clicked.connect(controller.redo)
+
+        # clear
+        btn_clear = icon_btn("clear.svg")
+        btn_clear.clicked.connect(controller.clear)
+
+        # quit
+        btn_quit = icon_btn("close.svg")
+        btn_quit.clicked.connect(controller.quit)
+
+        self.update_icons()
+
+    # menus
+    def fill_tool_menu(self, menu):
+        menu.addAction(
             "🖊️ pen",
             lambda: (self.controller.set_tool("pen")),
         )
-        tool_menu.addAction(
+        menu.addAction(
             "🖍️ highlight",
             lambda: (self.controller.set_tool("highlight")),
         )
-        tool_menu.addAction(
+        menu.addAction(
             " █  eraser",
             lambda: (self.controller.set_tool("eraser")),
         )
-        tool_menu.addAction(
+        menu.addAction(
             "［ ］ crop eraser",
             lambda: (self.controller.set_tool("crop_eraser")),
         )
-        self.btn_tool.setMenu(tool_menu)
 
-        # size (self)
-        self.btn_size = SizeButton(controller)
-        layout.addWidget(self.btn_size)
-        size_menu = QMenu(self)
+    def fill_size_menu(self, menu):
         for s in [4, 6, 10, 14, 20, 30, 50]:
-            size_menu.addAction(
+            menu.addAction(
                 f"{s}px",
                 lambda v=s: (self.controller.set_size(v)),
             )
-        self.btn_size.setMenu(size_menu)
 
-        # shape (self)
-        self.btn_shape = ShapeButton(controller)
-        layout.addWidget(self.btn_shape)
-        shape_menu = QMenu(self)
-        shape_menu.addAction(" S  free pen", lambda: self.controller.set_shape("free"))
-        shape_menu.addAction(" ╲  line", lambda: self.controller.set_shape("line"))
-        shape_menu.addAction("☐  rectangle", lambda: self.controller.set_shape("rect"))
-        self.btn_shape.setMenu(shape_menu)
+    def fill_shape_menu(self, menu):
+        menu.addAction(" S  free pen", lambda: self.controller.set_shape("free"))
+        menu.addAction(" ╲  line", lambda: self.controller.set_shape("line"))
+        menu.addAction("☐  rectangle", lambda: self.controller.set_shape("rect"))
 
-        # color (self)
-        self.btn_color = ColorButton(controller)
-        layout.addWidget(self.btn_color)
-        color_menu = QMenu(self)
+    def fill_color_menu(self, menu):
         colors = {
             "⬜ white": "white",
             "🟥 red": "red",
@@ -198,46 +325,78 @@ class Toolbar(QFrame):
             "🟪 purple": "purple",
         }
         for name, color in colors.items():
-            color_menu.addAction(
+            menu.addAction(
                 name,
                 lambda c=color: (self.controller.set_color(c)),
             )
-        self.btn_color.setMenu(color_menu)
 
-        # save
-        btn_save = icon_btn("save.svg")
-        save_menu = QMenu(self)
-        save_menu.addAction("⬛ Black background", lambda: controller.save("black"))
-        save_menu.addAction(
+    def fill_save_menu(self, menu):
+        controller = self.controller
+        menu.addAction("🖥️ Desktop background", lambda: controller.save("desktop"))
+        menu.addAction("⬛ Black background", lambda: controller.save("black"))
+        menu.addAction(
             " ....  Transparent background", lambda: controller.save("trans")
         )
-        save_menu.addAction("💾 Export JSON", lambda: controller.export_json())
-        save_menu.addAction("📂 Import JSON", lambda: controller.import_json())
-        btn_save.setMenu(save_menu)
-
-        # undo
-        btn_undo = icon_btn("undo.svg")
-        btn_undo.clicked.connect(controller.undo)
-
-        # redo
-        btn_redo = icon_btn("redo.svg")
-        btn_redo.clicked.connect(controller.redo)
-
-        # clear
-        btn_clear = icon_btn("clear.svg")
-        btn_clear.clicked.connect(controller.clear)
-
-        # quit
-        btn_quit = icon_btn("close.svg")
-        btn_quit.clicked.connect(controller.quit)
+        menu.addAction(
+            "✂️ Cropped to strokes", lambda: controller.save("trans", crop=True)
+        )
+        menu.addAction(
+            "🔍 Transparent at 2x", lambda: controller.save("trans", scale=2)
+        )
+        screens = QApplication.screens()
+        if len(screens) > 1:
+            for i, screen in enumerate(screens):
+                menu.addAction(
+                    f"🖥️ Monitor {i + 1} ({screen.name()})",
+                    lambda i=i: controller.save("desktop", screen=i),
+                )
+        menu.addAction("💾 Export JSON", lambda: controller.export_json())
+        menu.addAction("📂 Import JSON", lambda: controller.import_json())
+
+    def fill_layer_menu(self):
+        menu = self.layer_menu
+        menu.clear()
+
+        controller = self.controller
+        canva = controller.canva
+        for layer in reversed(canva.layers):
+            title = f"{'●' if layer.id == canva.active_layer else '○'} {layer.name}"
+            if not layer.visible:
+                title += "  (hidden)"
+            if layer.locked:
+                title += "  🔒"
+            if layer.opacity < 1:
+                title += f"  {layer.opacity:.0%}"
+
+            sub = menu.addMenu(title)
+            sub.addAction(
+                "✏️ Draw on this layer", lambda i=layer.id: controller.set_layer(i)
+            )
+            sub.addAction(
+                "🙈 Hide" if layer.visible else "👁️ Show",
+                lambda i=layer.id: controller.toggle_layer_visible(i),
+            )
+            sub.addAction(
+                "🔓 Unlock" if layer.locked else "🔒 Lock",
+                lambda i=layer.id: controller.toggle_layer_locked(i),
+            )
+            for opacity in (1.0, 0.75, 0.5, 0.25):
+                sub.addAction(
+                    f"◐ Opacity {opacity:.0%}",
+                    lambda i=layer.id, o=opacity: controller.set_layer_opacity(i, o),
+                )
 
-        self.update_icons()
+        menu.addSeparator()
+        menu.addAction("➕ New layer", controller.add_layer)
 
     def update_icons(self):
-        self.btn_tool.setIcon(get_icon(f"tools/{self.controller.tool}.svg"))
-        self.btn_size.update()
-        self.btn_shape.update()
-        self.btn_color.update()
+        # only what changed is repainted
+        if self.controller.tool != self._tool:
+            self._tool = self.controller.tool
+            self.btn_tool.setIcon(get_icon(f"tools/{self._tool}.svg"))
+
+        for btn in (self.btn_size, self.btn_shape, self.btn_color, self.btn_layer):
+            btn.refresh()
 
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
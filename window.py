@@ -3,30 +3,61 @@
 
 from PySide2.QtWidgets import QWidget, QApplication, QShortcut
 from PySide2.QtGui import QCursor, QKeySequence
-from PySide2.QtCore import Qt
+from PySide2.QtCore import Qt, QRect
 
 from canva import Canva
 from controller import Controller
+from overlay import Overlay
+from profiler import Profiler, startup
 from toolbar import Toolbar
 
 
 class Window(QWidget):
-    def __init__(self):
+    def __init__(self, all_screens=False, show=True):
         super().__init__()
+        self.all_screens = all_screens
 
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
         self.setAttribute(Qt.WA_TranslucentBackground)
 
         self.canva = Canva(self)
         self.controller = Controller(self, self.canva)
+        self.overlay = Overlay(self)
+        startup.mark("canvas and controller")
         self.toolbar = Toolbar(self, self.controller)
+        startup.mark("toolbar")
 
         self.controller.toolbar = self.toolbar
+        self.controller.overlay = self.overlay
         self.canva.toolbar = self.toolbar
+        self.canva.overlay = self.overlay
         self.canva.controller = self.controller
+        self.overlay.canva = self.canva
+        self.overlay.controller = self.controller
+
+        self.profiler = Profiler()
+        self.canva.profiler = self.profiler
+        self.overlay.profiler = self.profiler
+        self.controller.profiler = self.profiler
+
+        self.profiler.watch(
+            self.canva,
+            "render_tile",
+            "draw_strokes",
+            "erase_at",
+            "apply_crop_eraser",
+            "snapshot",
+            "load_session",
+        )
+        self.profiler.watch(self.canva.history, "push")
+        self.profiler.watch(self.controller, "save")
+
+        if self.profiler.path:
+            self.profiler.start()
 
         self.toolbar.raise_()
-        self.showFullScreen()
+        if show:
+            self.present()
 
         # shortcuts
         def shortcut(key, func):
@@ -42,6 +73,7 @@ class Window(QWidget):
         shortcut("Z", lambda: self.controller.toggle_tool())
         shortcut("X", lambda: self.controller.toggle_shape())
         shortcut("C", lambda: self.controller.toggle_color())
+        shortcut("L", lambda: self.controller.toggle_layer())
 
         # Direct Actions:
         shortcut("6", lambda: self.controller.save())
@@ -61,8 +93,9 @@ class Window(QWidget):
         shortcut("Ctrl+Y", lambda: self.controller.redo())
         shortcut("Ctrl+X", lambda: self.controller.clear())
         shortcut("Ctrl+R", lambda: self.controller.quit())
+        shortcut("Ctrl+0", lambda: self.controller.reset_view())
 
-        shortcut("Esc", lambda: self.controller.quit())
+        shortcut("Esc", lambda: self.controller.cancel_or_quit())
 
         # Quick Mode Toggles:
         shortcut("W", lambda: self.controller.toggle_drawing_mode())
@@ -93,18 +126,56 @@ class Window(QWidget):
         shortcut("Shift+Z", lambda: self.controller.toggle_tool(reverse=True))
         shortcut("Shift+X", lambda: self.controller.toggle_shape(reverse=True))
         shortcut("Shift+C", lambda: self.controller.toggle_color(reverse=True))
+        shortcut("Shift+L", lambda: self.controller.toggle_layer(reverse=True))
+
+        # Debug:
+        shortcut("P", lambda: self.controller.toggle_repaint_regions())
+        shortcut("I", lambda: self.controller.toggle_hud())
+        startup.mark("shortcuts")
 
     def wheelEvent(self, event):
         delta = event.angleDelta().y()
         pos = self.mapFromGlobal(QCursor.pos())
 
-        self.controller.adjust_size(delta, pos)
+        if event.modifiers() & Qt.ControlModifier:
+            self.controller.zoom(delta, pos)
+        else:
+            self.controller.adjust_size(delta, pos)
 
     def resizeEvent(self, event):
         self.canva.setGeometry(self.rect())
+        self.overlay.setGeometry(self.rect())
         self.toolbar.adjustSize()
         tw = self.toolbar.width()
-        self.toolbar.move((self.width() - tw) // 2, 10)
+
+        # top center of the primary monitor when spanning several
+        g = QApplication.primaryScreen().geometry()
+        area = QRect(self.mapFromGlobal(g.topLeft()), g.size()) & self.rect()
+        if area.isEmpty():
+            area = self.rect()
+        self.toolbar.move(area.x() + (area.width() - tw) // 2, area.y() + 10)
+
+    def present(self):
+        if not self.isVisible():
+            self.controller.capture_desktop()
+
+        if self.all_screens:
+            self.setGeometry(QApplication.primaryScreen().virtualGeometry())
+            self.show()
+        else:
+            self.showFullScreen()
+
+        self.raise_()
+        self.activateWindow()
 
     def closeEvent(self, event=None):
+        # a resident board is only hidden, see Controller.quit
+        if self.controller.resident and event:
+            event.ignore()
+            self.controller.hide_overlay()
+            return
+
+        self.controller.wait_task()
+        self.controller.close_journal()
+        self.profiler.dump()
         QApplication.instance().quit()
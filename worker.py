@@ -0,0 +1,54 @@
+# worker.py
+# type: ignore
+
+import threading
+
+from PySide2.QtCore import QObject, QRunnable, Signal
+
+
+class Cancelled(Exception):
+    pass
+
+
+class TaskSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+
+class Task(QRunnable):
+    # runs func(*args, progress=report) on the thread pool, results come back
+    # through signals on the GUI thread; func must not touch any widget
+    def __init__(self, func, *args):
+        super().__init__()
+        self.setAutoDelete(False)
+
+        self.func = func
+        self.args = args
+        self.signals = TaskSignals()
+
+        self._cancel = threading.Event()
+        self._percent = -1
+
+    def cancel(self):
+        self._cancel.set()
+
+    def report(self, done, total):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+        percent = done * 100 // max(1, total)
+        if percent != self._percent:
+            self._percent = percent
+            self.signals.progress.emit(percent)
+
+    def run(self):
+        try:
+            result = self.func(*self.args, progress=self.report)
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e) or type(e).__name__)
+        else:
+            self.signals.finished.emit(result)